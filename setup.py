@@ -32,5 +32,8 @@ setup(name='stubo',
       delete_test_dbs = stubo.scripts.admin:delete_test_dbs  
       create_tracker_collection = stubo.scripts.admin:create_tracker_collection  
       purge_stubs = stubo.scripts.admin:purge_stubs  
+      migrate_session_keys = stubo.scripts.admin:migrate_session_keys
+      recode_cache_values = stubo.scripts.admin:recode_cache_values
+      benchmark_codecs = stubo.scripts.admin:benchmark_codecs
       """
       )
@@ -10,15 +10,38 @@
 import logging
 import datetime
 import time
+import uuid
 
-from .queue import String, Hash, Queue, get_redis_master, get_redis_slave
+from .queue import (
+    String, Hash, Queue, get_redis_master, get_redis_slave, scan_keys,
+    escape_pattern
+)
+from . import codec, scripts
 from stubo.exceptions import exception_response
-from stubo.utils import asbool
+from stubo.utils import asbool, compute_hash
+from stubo.utils.lru import LRUCache
 from stubo.model.db import Scenario
 from stubo.model.stub import Stub, StubCache, response_hash
 
 log = logging.getLogger(__name__)
 
+# decoded playback sessions for this worker process keyed by
+# (host, scenario_name, session_name), see Cache.get_cached_session
+session_cache = LRUCache(maxsize=100)
+
+# where the request, response and request index data of sessions is kept,
+# 'scenario' in hashes shared by the sessions of a scenario and 'session' in
+# hashes of each session, see Cache.session_key_name
+SESSION_KEY_LAYOUTS = ('scenario', 'session')
+session_key_layout = 'scenario'
+
+# the hashes holding the data of a session
+SESSION_DATA_KEYS = ('request', 'request_count', 'response', 'request_index')
+
+# compressed responses decoded by this worker process keyed by
+# (host, scenario_name) -> [responses, secs], see Cache.decode_response
+response_decompression = {}
+
 """
 Redis is used for caching
 Keys are replicated from master to slave redis instances in distributed envs
@@ -81,10 +104,18 @@ begin/session?scenario=first&session=first_1&mode=playback
         }
     ], 
     "scenario_id": "546f27c681875907691e30f6", 
-    "session": "first_1"
+    "session": "first_1",
+    "version": "5b0b4c9e0d7e4a66a4f5f0b7c5d4e3a1"
 }
 
 
+(Hash)
+name                                key->value (raw)
+host:scenario_name:session_version  session_name->version
+
+The version changes whenever the session is written so workers can check
+their decoded copy of the session is current with a single HGET.
+
 (Hash)
 name                            key->value (json)
 host:scenario_name:response     session_name:response_id->response_text 
@@ -93,6 +124,16 @@ redis 127.0.0.1:6379> hgetall "localhost:first:response"
 1) "first_1:1a90f47bb0af291264a6c06868b97cd62b372d41de26c3fd21cef61b"
 2) "\"Hello {{1+1}} World\\n\""
 
+Responses of at least response_compress_threshold bytes are stored zlib
+compressed, see stubo.cache.codec. The compression of the responses of a
+scenario is counted in
+
+(Hash)
+name                                      key->value (raw)
+host:scenario_name:response_compression   responses->count, compressed->count,
+                                          bytes->count, stored_bytes->count,
+                                          compress_us->count
+
 (Hash)
 name                            key->value (json)
 host:scenario_name:request      session_name:request_id->[[response_ids], delay_policy_name, recorded, system_date,
@@ -105,10 +146,25 @@ redis 127.0.0.1:6379> hgetall "localhost:first:request"
 2) "[[\"1a90f47bb0af291264a6c06868b97cd62b372d41de26c3fd21cef61b\"], \"\", \"2014-11-21\", \"2014-11-25\", {},
       \"84dab03cd9cbf56782635f95ef74efc641d993e768b79b4344452b45\"]"
 
+(Hash)
+name                               key->value (raw)
+host:scenario_name:request_count   session_name:response_ids_hash->count
+
+The number of requests cached for the same responses, see add_request.
+
 (Hash)
 name                               key->value (raw)
 host:scenario_name:request_index   session_name:request_index_key->index
 
+With session_key_layout = session the request, request_count, response and
+request_index hashes are kept per session, so ending a session is a single
+UNLINK rather than deleting its keys from hashes shared by every session of
+the scenario. The keys of these hashes are unchanged.
+
+(Hash)
+name                                            key->value
+host:scenario_name:session:session_name:request session_name:request_id->...
+
 (Hash)
 name                                     key->value (json)
 host:scenario_name:saved_request_index   name-> {request_index_key : index}
@@ -163,8 +219,22 @@ class Cache(object):
         return '{0}:{1}'.format(self.host, scenario_name)
 
     def set_session(self, scenario_name, session_name, session_payload):
-        return self.set(self.scenario_key_name(scenario_name), session_name,
-                        session_payload)
+        result = self.set(self.scenario_key_name(scenario_name), session_name,
+                          session_payload)
+        self.set_session_version(scenario_name, session_name)
+        return result
+
+    def set_session_version(self, scenario_name, session_name, version=None):
+        """Stamp the session with a new version so workers know to fetch it
+        again, must be called after the session is written."""
+        version = version or uuid.uuid4().hex
+        self.set_raw(self.get_session_version_key(scenario_name), session_name,
+                     version)
+        return version
+
+    def get_session_version(self, scenario_name, session_name, local=True):
+        return self.hash_cls()(get_redis_server(local)).get_raw(
+            self.get_session_version_key(scenario_name), session_name)
 
     def set_session_map(self, scenario_name, session_name):
         return self.set_raw(self.get_sessions_map_key(), session_name,
@@ -207,7 +277,8 @@ class Cache(object):
 
     def get_all_saved_request_index_data(self):
         master = get_redis_master()
-        keys = master.keys('{0}:*:saved_request_index'.format(self.host))
+        keys = scan_keys(master, '{0}:*:saved_request_index'.format(
+            escape_pattern(self.host)))
         info = {}
         for key in keys:
             scenario_name = key.split(':')[1]
@@ -228,6 +299,15 @@ class Cache(object):
             scenario_name))
         deleted_requests = self.hash_cls()(master).remove(self.get_request_key(
             scenario_name))
+        self.hash_cls()(master).remove(self.get_request_count_key(
+            scenario_name))
+        self.hash_cls()(master).remove(self.get_session_version_key(
+            scenario_name))
+        self.hash_cls()(master).remove(self.get_response_compression_key(
+            scenario_name))
+        if session_key_layout == 'session':
+            self.hash_cls()(master).unlink(*self.session_data_keys(
+                scenario_name))
 
         # delete request indexes
         deleted_request_indexes = []
@@ -279,22 +359,125 @@ class Cache(object):
     def key_name(self, scenario_name, key):
         return '{0}:{1}'.format(self.scenario_key_name(scenario_name), key)
 
-    def get_response_key(self, scenario_name):
-        return self.key_name(scenario_name, "response")
+    def session_key_name(self, scenario_name, session_name, key,
+                         layout=None):
+        """Return the name of the hash holding the key data of the session,
+        shared by the sessions of the scenario unless the layout is
+        'session'."""
+        layout = layout or session_key_layout
+        if layout == 'session' and session_name:
+            return self.key_name(scenario_name, 'session:{0}:{1}'.format(
+                session_name, key))
+        return self.key_name(scenario_name, key)
+
+    def session_data_keys(self, scenario_name):
+        """Yield the names of the hashes of sessions kept in hashes of their
+        own."""
+        return scan_keys(get_redis_master(), '{0}:session:*'.format(
+            escape_pattern(self.scenario_key_name(scenario_name))))
+
+    def get_response_key(self, scenario_name, session_name=None):
+        return self.session_key_name(scenario_name, session_name, "response")
+
+    def get_request_key(self, scenario_name, session_name=None):
+        return self.session_key_name(scenario_name, session_name, "request")
+
+    def get_request_index_key(self, scenario_name, session_name=None):
+        return self.session_key_name(scenario_name, session_name,
+                                     "request_index")
 
-    def get_request_key(self, scenario_name):
-        return self.key_name(scenario_name, "request")
+    def get_request_count_key(self, scenario_name, session_name=None):
+        return self.session_key_name(scenario_name, session_name,
+                                     "request_count")
 
-    def get_request_index_key(self, scenario_name):
-        return self.key_name(scenario_name, "request_index")
+    def get_session_version_key(self, scenario_name):
+        return self.key_name(scenario_name, "session_version")
 
     def get_saved_request_index_key(self, scenario_name):
         return self.key_name(scenario_name, "saved_request_index")
 
+    def get_response_compression_key(self, scenario_name):
+        return self.key_name(scenario_name, "response_compression")
+
+    def encode_responses(self, scenario_name, responses):
+        """Return the responses encoded for the response hash, large ones
+        compressed, and count the compression for the scenario."""
+        encoded = {}
+        stats = dict(responses=0, compressed=0, bytes=0, stored_bytes=0,
+                     compress_us=0)
+        for key, response in responses.iteritems():
+            raw = codec.encode(response)
+            start = time.time()
+            stored = codec.compress(raw)
+            if stored is not raw:
+                stats['compressed'] += 1
+                stats['compress_us'] += int((time.time() - start) * 1000000)
+            stats['responses'] += 1
+            stats['bytes'] += len(raw)
+            stats['stored_bytes'] += len(stored)
+            encoded[key] = stored
+        master = get_redis_master()
+        for field, value in stats.iteritems():
+            if value:
+                self.hash_cls()(master).incr(self.get_response_compression_key(
+                    scenario_name), field, value)
+        return encoded
+
+    def decode_response(self, scenario_name, raw):
+        if raw is None:
+            return None
+        if not codec.compressed(raw):
+            return codec.decode(raw)
+        start = time.time()
+        response = codec.decode(raw)
+        stats = response_decompression.setdefault((self.host, scenario_name),
+                                                  [0, 0.0])
+        stats[0] += 1
+        stats[1] += time.time() - start
+        return response
+
+    def get_response_compression(self, scenario_name):
+        """Return the compression ratio of the responses of the scenario and
+        the time spent compressing them, and decompressing them in this worker
+        process."""
+        stats = dict(responses=0, compressed=0, bytes=0, stored_bytes=0)
+        stats.update(self.hash_cls()(get_redis_master()).get_all(
+            self.get_response_compression_key(scenario_name)) or {})
+        compress_us = stats.pop('compress_us', 0)
+        decompressed, decompress_secs = response_decompression.get(
+            (self.host, scenario_name), (0, 0.0))
+        stats.update(
+            ratio=round(float(stats['bytes']) / stats['stored_bytes'], 2)
+            if stats['stored_bytes'] else 1.0,
+            compress_ms=round(compress_us / 1000.0, 2),
+            decompressed=decompressed,
+            decompress_ms=round(decompress_secs * 1000, 2))
+        return stats
+
+    def encoded_hash_names(self, scenario_name):
+        """Return the names of the hashes of the scenario with encoded
+        values."""
+        master = get_redis_master()
+        names = set([self.scenario_key_name(scenario_name),
+                     self.get_saved_request_index_key(scenario_name)])
+        session_names = self.hash_cls()(master).keys(
+            self.scenario_key_name(scenario_name))
+        for session_name in [None] + list(session_names):
+            names.update((self.get_request_key(scenario_name, session_name),
+                          self.get_response_key(scenario_name, session_name)))
+        return sorted(names)
+
     def get_request_index_data(self, scenario_name):
         master = get_redis_master()
-        return self.hash_cls()(master).get_all_raw(self.get_request_index_key(
-            scenario_name))
+        if session_key_layout != 'session':
+            return self.hash_cls()(master).get_all_raw(
+                self.get_request_index_key(scenario_name))
+        data = {}
+        for session_name in self.hash_cls()(master).keys(
+                self.scenario_key_name(scenario_name)):
+            data.update(self.hash_cls()(master).get_all_raw(
+                self.get_request_index_key(scenario_name, session_name)))
+        return data
 
     def reset_request_index(self, scenario_name):
         for k in self.get_request_index_data(scenario_name).iterkeys():
@@ -313,25 +496,29 @@ class Cache(object):
         return self.get(self.get_saved_request_index_key(scenario_name), name)
 
     def set_request_index_item(self, scenario_name, name, value):
-        return self.set_raw(self.get_request_index_key(scenario_name), name,
-                            value)
+        # name is session_name:request_index_key
+        return self.set_raw(self.get_request_index_key(
+            scenario_name, name.partition(':')[0]), name, value)
 
     def request_index_item_exists(self, scenario_name, name):
-        return self.exists(self.get_request_index_key(scenario_name), name)
+        return self.exists(self.get_request_index_key(
+            scenario_name, name.partition(':')[0]), name)
 
     def request_index_exists(self, scenario_name):
+        if session_key_layout == 'session':
+            return bool(self.get_request_index_data(scenario_name))
         return key_exists(self.get_request_index_key(scenario_name))
 
     def delete_session_data(self, scenario_name, session):
         master = get_redis_master()
-        keys = (self.get_request_key(scenario_name),
-                self.get_response_key(scenario_name),
-                self.get_request_index_key(scenario_name))
-        hashes = [x.format(self.scenario_key_name(scenario_name)) for x in keys]
+        if session_key_layout == 'session':
+            self.hash_cls()(master).unlink(*[self.session_key_name(
+                scenario_name, session, x) for x in SESSION_DATA_KEYS])
+            return
+        hashes = [self.key_name(scenario_name, x) for x in SESSION_DATA_KEYS]
+        match = '{0}:*'.format(escape_pattern(session))
         for _hash in hashes:
-            keys = self.hash_cls()(master).keys(_hash)
-            session_keys = [x for x in keys if x.startswith('{0}:'.format(
-                session))]
+            session_keys = list(self.hash_cls()(master).scan(_hash, match))
             if session_keys:
                 log.debug('deleting {0} from {1}'.format(session_keys, _hash))
                 num_deleted = 0
@@ -339,6 +526,33 @@ class Cache(object):
                     num_deleted += self.hash_cls()(master).delete(_hash, k)
                 log.debug('deleted {0}'.format(num_deleted))
 
+    def migrate_session_data(self, scenario_name, layout):
+        """Move the session data of the scenario to the hashes of the given
+        layout. Stubo must be stopped, sessions in use would lose data.
+        Returns the number of hash keys moved."""
+        if layout not in SESSION_KEY_LAYOUTS:
+            raise ValueError('unknown session key layout: {0}'.format(layout))
+        master = get_redis_master()
+        moved = 0
+        for key in SESSION_DATA_KEYS:
+            if layout == 'session':
+                names = [self.key_name(scenario_name, key)]
+            else:
+                names = list(scan_keys(master, '{0}:session:*:{1}'.format(
+                    escape_pattern(self.scenario_key_name(scenario_name)),
+                    key)))
+            for name in names:
+                by_session = {}
+                for k, v in self.hash_cls()(master).get_all_raw(
+                        name).iteritems():
+                    by_session.setdefault(k.partition(':')[0], {})[k] = v
+                for session_name, data in by_session.iteritems():
+                    self.hash_cls()(master).set_many_raw(self.session_key_name(
+                        scenario_name, session_name, key, layout=layout), data)
+                    moved += len(data)
+                self.hash_cls()(master).unlink(name)
+        return moved
+
     def assert_valid_session(self, scenario_name, session_name):
         scenario_key = self.scenario_key_name(scenario_name)
         # if session exists it can only be dormant
@@ -367,7 +581,9 @@ class Cache(object):
 
     def set_response(self, scenario, session_name, response_id, val):
         response_key = '{0}:{1}'.format(session_name, response_id)
-        self.set(self.get_response_key(scenario), response_key, val)
+        self.set_raw(self.get_response_key(scenario, session_name),
+                     response_key, self.encode_responses(
+                         scenario, {response_key: val})[response_key])
 
     def get_request(self, scenario_name, session_name, request_id, local=True):
         """
@@ -381,7 +597,8 @@ class Cache(object):
         log.debug('get_request: {0}:{1} {2} {3}'.format(self.host,
                                                         scenario_name, session_name, request_id))
         request_key = '{0}:{1}'.format(session_name, request_id)
-        return self.get(self.get_request_key(scenario_name), request_key, local)
+        return self.get(self.get_request_key(scenario_name, session_name),
+                        request_key, local)
 
     def get_response(self, scenario_name, session_name, response_ids,
                      request_index_key):
@@ -393,25 +610,59 @@ class Cache(object):
         if num_responses > 1:
             # stateful response: lookup the response index value stored on master
             master = get_redis_master()
-            request_index_name = self.get_request_index_key(scenario_name)
+            request_index_name = self.get_request_index_key(scenario_name,
+                                                            session_name)
             request_index_key = '{0}:{1}'.format(session_name, request_index_key)
+            try:
+                # advance the index and get its response in one round trip
+                response = scripts.run_script(master, scripts.NEXT_RESPONSE,
+                    (request_index_name, self.get_response_key(scenario_name,
+                                                               session_name)),
+                    [request_index_key] + ['{0}:{1}'.format(session_name, x)
+                                           for x in response_ids])
+                return self.decode_response(scenario_name, response)
+            except scripts.ScriptUnavailable:
+                pass
             index = self.get(request_index_name, request_index_key)
             if not index or index < num_responses:
                 index = self.hash_cls()(master).incr(request_index_name, request_index_key)
             index -= 1
         response_key = '{0}:{1}'.format(session_name, response_ids[index])
-        return self.get(self.get_response_key(scenario_name), response_key,
-                        local=True)
+        return self.decode_response(scenario_name, self.hash_cls()(
+            get_redis_server(True)).get_raw(self.get_response_key(
+                scenario_name, session_name), response_key))
 
     def get_session(self, scenario_name, session_name, local=True):
         return self.get(self.scenario_key_name(scenario_name), session_name,
                         local=local) or {}
 
+    def get_cached_session(self, scenario_name, session_name, local=True):
+        """Return the session, decoded from the cache only if its version
+        has changed since this worker last decoded it. Playback sessions are
+        shared by all the requests of the worker so must not be modified.
+        """
+        key = (self.host, scenario_name, session_name)
+        # read the version first, a session written after it is then only
+        # cached under an older version and fetched again next time
+        version = self.get_session_version(scenario_name, session_name, local)
+        if version:
+            cached = session_cache.get(key, valid=lambda x: x[0] == version)
+            if cached:
+                return cached[1]
+        raw = self.hash_cls()(get_redis_server(local)).get_raw(
+            self.scenario_key_name(scenario_name), session_name)
+        session = codec.decode(raw) if raw else {}
+        if version and session.get('status') == 'playback':
+            session_cache.set(key, (version, session), nbytes=len(raw))
+        else:
+            session_cache.pop(key)
+        return session
+
     def get_session_with_delay(self, scenario_name, session_name, retry_count=5,
                                retry_interval=1):
         for i in range(retry_count):
             scenario_key = self.scenario_key_name(scenario_name)
-            session = self.get_session(scenario_name, session_name)
+            session = self.get_cached_session(scenario_name, session_name)
             if not session:
                 raise exception_response(500,
                                          title="session {0} not found!".format(session_name))
@@ -429,7 +680,7 @@ class Cache(object):
         return session, i
 
     def create_session_cache(self, scenario_name, session_name,
-                             system_date=None):
+                             system_date=None, adaptive_order=False):
         scenario_key = self.scenario_key_name(scenario_name)
         log.debug("create_session_cache: scenario_key={0}, session_name={1}".format(
             scenario_key, session_name))
@@ -444,6 +695,8 @@ class Cache(object):
             self.set_raw('{0}:sessions'.format(self.host), session_name, scenario_name)
 
         session['status'] = 'playback'
+        # try the most matched stubs first where that can't change the result
+        session['adaptive_order'] = adaptive_order
         session['system_date'] = system_date or datetime.date.today().strftime(
             '%Y-%m-%d')
         session['last_used'] = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
@@ -458,28 +711,40 @@ class Cache(object):
                                      title="Precondition failed: no stubs were"
                                            " found in database for scenario: {0}".format(scenario_key))
         from stubo.ext.module import Module
-
+        from stubo.match.plan import classify_stub, compile_session
+
+        module = Module(self.host)
+        # module versions and delay policies are looked up once per name
+        module_versions = {}
+        delay_policies = {}
+        # response key -> response, written in bulk once all stubs are done
+        responses = {}
         for scenario_stub in stubs:
             stub = Stub(scenario_stub['stub'], scenario_stub['scenario'])
             if stub.module():
                 module_name = stub.module()['name']
                 # tag this stub with the latest version of the module
-                module = Module(self.host)
-                version = module.latest_version(module_name)
+                if module_name not in module_versions:
+                    module_versions[module_name] = module.latest_version(
+                        module_name)
+                version = module_versions[module_name]
                 if not version:
                     raise exception_response(500,
                                              title="module '{0}' not found in cache".format(
                                                  module.key(module_name)))
                 stub.module()['version'] = version
 
+            # classify the stub once so static stubs can skip the transformer,
+            # the response is cached with the flags for get/response
+            stub.response()['transform'] = classify_stub(stub.payload)
             response_ids = []
             response_bodys = stub.response_body()
             # cache each response id -> response (text, status) etc
             for response_text in response_bodys:
                 stub.set_response_body(response_text)
                 response_id = response_hash(response_text, stub)
-                self.set_response(scenario_name, session_name, response_id,
-                                  stub.response())
+                responses['{0}:{1}'.format(session_name, response_id)] = \
+                    dict(stub.response())
                 response_ids.append(response_id)
 
                 # replace response text with response hash ids for session cache
@@ -490,18 +755,29 @@ class Cache(object):
                 # Note: the delay policy is not really cached with the session.
                 # The get/response call will just use the name to get the latest
                 # delay value from the 'delay_policy' key in redis.
-                delay_policy_key = '{0}:delay_policy'.format(self.host)
-                delay_policy = self.get(delay_policy_key, delay_policy_name)
-                if not delay_policy:
-                    log.warn('unable to find delay_policy: {0}'.format(
-                        delay_policy_name))
-                stub.set_delay_policy(delay_policy)
+                policy_key = unicode(delay_policy_name)
+                if policy_key not in delay_policies:
+                    delay_policy_key = '{0}:delay_policy'.format(self.host)
+                    delay_policy = self.get(delay_policy_key, delay_policy_name)
+                    if not delay_policy:
+                        log.warn('unable to find delay_policy: {0}'.format(
+                            delay_policy_name))
+                    delay_policies[policy_key] = delay_policy
+                stub.set_delay_policy(delay_policies[policy_key])
             # _id = ObjectId(scenario_stub['_id'])
             # stub['recorded'] = str(_id.generation_time.date())
             cache_info.append(stub.payload)
+        self.hash_cls()(get_redis_master()).set_many_raw(
+            self.get_response_key(scenario_name, session_name),
+            self.encode_responses(scenario_name, responses))
         session['stubs'] = cache_info
+        # stamp the session so workers can tell when their compiled matchers
+        # are out of date
+        session['version'] = uuid.uuid4().hex
         # log.debug('stubs: {0}'.format(session['stubs']))
         self.set(scenario_key, session_name, session)
+        self.set_session_version(scenario_name, session_name, session['version'])
+        compile_session(session)
         log.debug('created session cache: {0}:{1}'.format(session['scenario'],
                                                           session['session']))
         return session
@@ -550,28 +826,44 @@ def add_request(session, request_id, stub, system_date, stub_number,
     request_key = '{0}:{1}'.format(session_name, request_id)
     request_index_key = get_request_index_hash_key(session, stub_number)
 
-    request_values = cache.hash_cls()(get_redis_slave()).values(cache.get_request_key(
-        scenario_name))
-    cached_requests = [x for x in request_values if stub.response_ids() == x[0]]
-    if len(cached_requests) < request_cache_limit:
-        # Note only cache the first of request_cache_limit requests that have 
-        # the same response. Stops memory exhaustion if a test generates a 
-        # unique request each time.
-        result = cache.set(cache.get_request_key(scenario_name),
-                           request_key,
-                           (stub.response_ids(), stub.delay_policy_name(),
-                            stub.recorded(), system_date, stub.module(),
-                            request_index_key))
-        log.debug('add_request: {0} {1} {2} {3} {4} stub_number={5} '
-                  'request_index_key={6}, result={7}'.format(scenario_key,
-                                                             session_name, request_id, stub.response_ids(),
-                                                             stub.delay_policy_name(), stub_number, request_index_key,
-                                                             result))
+    # Note only cache the first of request_cache_limit requests that have
+    # the same response. Stops memory exhaustion if a test generates a
+    # unique request each time.
+    count_name = cache.get_request_count_key(scenario_name, session_name)
+    count_key = '{0}:{1}'.format(session_name, compute_hash(u','.join(
+        unicode(x) for x in stub.response_ids())))
+    request_name = cache.get_request_key(scenario_name, session_name)
+    value = (stub.response_ids(), stub.delay_policy_name(), stub.recorded(),
+             system_date, stub.module(), request_index_key)
+    master = get_redis_master()
+    try:
+        # count and cache the request in one step so concurrent workers
+        # can't exceed the limit
+        result = scripts.run_script(master, scripts.ADD_REQUEST,
+                                    (count_name, request_name),
+                                    [count_key, request_cache_limit,
+                                     request_key, codec.encode(value)])
+    except scripts.ScriptUnavailable:
+        result = 1
+        requests = cache.hash_cls()(master)
+        if not requests.exists(request_name, request_key):
+            if requests.incr(count_name, count_key) > request_cache_limit:
+                # give the place back, the count is of the requests cached
+                requests.incr(count_name, count_key, -1)
+                result = 0
+        if result:
+            requests.set(request_name, request_key, value)
+    log.debug('add_request: {0} {1} {2} {3} {4} stub_number={5} '
+              'request_index_key={6}, result={7}'.format(scenario_key,
+                                                         session_name, request_id, stub.response_ids(),
+                                                         stub.delay_policy_name(), stub_number, request_index_key,
+                                                         result))
     return request_index_key
 
 
 def get_keys(key_pattern, local=False):
-    return get_redis_server(local=local).keys(key_pattern)
+    """Yield the keys matching the pattern, scanned incrementally."""
+    return scan_keys(get_redis_server(local), key_pattern)
 
 
 def get_redis_server(local=True):
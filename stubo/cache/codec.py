@@ -0,0 +1,123 @@
+"""
+    stubo.cache.codec
+    ~~~~~~~~~~~~~~~~~
+
+    Encoding of the values stored in redis hashes.
+
+    Values are written with the codec selected by ``redis.codec`` (json by
+    default). msgpack values start with a format byte that JSON text never
+    starts with, so values written by either codec can always be read.
+    Encoded values may be compressed with zlib, marked by another format
+    byte, see compress.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# first byte of msgpack encoded values
+MSGPACK_FORMAT = '\x01'
+
+# first byte of zlib compressed values
+ZLIB_FORMAT = '\x02'
+
+# encoded values of at least compress_threshold bytes are compressed by
+# compress, 0 turns compression off
+compress_threshold = 0
+compress_level = 6
+
+
+class JSONCodec(object):
+    name = 'json'
+
+    def encode(self, value):
+        return json.dumps(value)
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+class MsgpackCodec(object):
+    """Smaller and quicker to decode than JSON for large sessions. Strings
+    are read back as unicode as they are from JSON."""
+    name = 'msgpack'
+
+    def encode(self, value):
+        return MSGPACK_FORMAT + msgpack.packb(value, use_bin_type=False)
+
+    def decode(self, raw):
+        if msgpack is None:
+            raise ValueError('msgpack must be installed to read msgpack '
+                             'encoded values')
+        return msgpack.unpackb(raw[1:], encoding='utf-8')
+
+
+codecs = {
+    'json': JSONCodec(),
+    'msgpack': MsgpackCodec()
+}
+
+# the codec new values are written with
+codec = codecs['json']
+
+
+def set_codec(name):
+    global codec
+    if name not in codecs:
+        raise ValueError('unknown codec: {0}, expected one of {1}'.format(
+            name, sorted(codecs)))
+    if name == 'msgpack' and msgpack is None:
+        raise ValueError('msgpack codec selected but msgpack is not installed')
+    codec = codecs[name]
+    return codec
+
+
+def encode(value):
+    return codec.encode(value)
+
+
+def decode(raw):
+    """Decode a value written by any of the codecs, compressed or not."""
+    if raw[:1] == ZLIB_FORMAT:
+        raw = zlib.decompress(raw[1:])
+    if raw[:1] == MSGPACK_FORMAT:
+        return codecs['msgpack'].decode(raw)
+    return json.loads(raw)
+
+
+def compress(raw):
+    """Return the encoded value compressed if it is at least
+    compress_threshold bytes."""
+    if compress_threshold and len(raw) >= compress_threshold:
+        return ZLIB_FORMAT + zlib.compress(raw, compress_level)
+    return raw
+
+
+def compressed(raw):
+    return raw[:1] == ZLIB_FORMAT
+
+
+def encoded_with(raw):
+    """Return the name of the codec the value was written with."""
+    if compressed(raw):
+        raw = zlib.decompress(raw[1:])
+    return 'msgpack' if raw[:1] == MSGPACK_FORMAT else 'json'
+
+
+def recode(raw):
+    """Return the value written with the current codec and compressed if it
+    was, or None if it already is written with the current codec."""
+    if compressed(raw):
+        value = recode(zlib.decompress(raw[1:]))
+        if value is not None:
+            value = ZLIB_FORMAT + zlib.compress(value, compress_level)
+        return value
+    if encoded_with(raw) == codec.name:
+        return None
+    return encode(decode(raw))
@@ -5,11 +5,21 @@
 import logging
 import json
 
+from redis.exceptions import ResponseError
+
+from . import codec
+
 log = logging.getLogger(__name__)
 
 redis_server = None
 redis_master_server = None
 
+# keys asked for in each SCAN call, see scan_keys
+scan_count = 1000
+
+# cleared on the first UNLINK refused by an older redis server
+unlink_supported = True
+
 
 def get_redis_slave():
     return redis_server
@@ -19,6 +29,18 @@ def get_redis_master():
     return redis_master_server
 
 
+def scan_keys(server, pattern, count=None):
+    """Yield the keys matching pattern a batch at a time using SCAN, so the
+    server is never blocked walking the whole keyspace as with KEYS. A key
+    may be yielded more than once if it is renamed during the scan."""
+    return server.scan_iter(match=pattern, count=count or scan_count)
+
+
+def escape_pattern(text):
+    """Escape the glob characters in text for use in a SCAN match pattern."""
+    return ''.join('\\' + x if x in '*?[]\\' else x for x in text)
+
+
 class QueueIterator(object):
     def __init__(self, queue, start=0):
         self.q = queue
@@ -110,16 +132,43 @@ class Hash(object):
 
     def get(self, name, key):
         try:
-            return json.loads(self.get_raw(name, key))
+            return codec.decode(self.get_raw(name, key))
         except TypeError:
             return None
 
     def set(self, name, key, msg):
-        return self.set_raw(name, key, json.dumps(msg))
+        return self.set_raw(name, key, codec.encode(msg))
 
     def set_raw(self, name, key, msg):
         return self.server.hset(name, key, msg)
 
+    def set_many(self, name, mapping, chunk_size=1000):
+        """
+        set many hash keys to encoded values, one HMSET per chunk of keys
+        all sent in one pipeline
+        """
+        return self.set_many_raw(name, dict((k, codec.encode(v)) for k, v in
+                                            mapping.iteritems()), chunk_size)
+
+    def set_many_raw(self, name, mapping, chunk_size=1000):
+        items = mapping.items()
+        pipe = self.server.pipeline(transaction=False)
+        for i in range(0, len(items), chunk_size):
+            pipe.hmset(name, dict(items[i:i + chunk_size]))
+        return pipe.execute()
+
+    def recode(self, name, chunk_size=1000):
+        """
+        write the values of the hash not encoded with the current codec again,
+        returns the number of values written
+        """
+        values = dict((k, codec.recode(v)) for k, v in
+                      self.get_all_raw(name).iteritems())
+        values = dict((k, v) for k, v in values.iteritems() if v is not None)
+        if values:
+            self.set_many_raw(name, values, chunk_size)
+        return len(values)
+
     def incr(self, name, key, amount=1):
         return self.server.hincrby(name, key, amount=amount)
 
@@ -130,14 +179,20 @@ class Hash(object):
         return self.server.hgetall(name)
 
     def get_all(self, name):
-        return dict((k, json.loads(v)) for k, v in self.server.hgetall(
+        return dict((k, codec.decode(v)) for k, v in self.server.hgetall(
             name).iteritems())
 
     def keys(self, name):
         return self.server.hkeys(name)
 
+    def scan(self, name, match=None, count=None):
+        """Yield the hash keys matching the glob pattern using HSCAN."""
+        for key, _ in self.server.hscan_iter(name, match=match,
+                                             count=count or scan_count):
+            yield key
+
     def values(self, name):
-        return [json.loads(x) for x in self.server.hvals(name)]
+        return [codec.decode(x) for x in self.server.hvals(name)]
 
     def delete(self, name, *keys):
         """
@@ -151,6 +206,24 @@ class Hash(object):
         """
         return self.server.delete(name)
 
+    def unlink(self, *names):
+        """
+        delete the hashes, their memory is reclaimed in the background by
+        redis servers that support UNLINK (>= 4.0)
+        """
+        global unlink_supported
+        if not names:
+            return 0
+        if unlink_supported:
+            try:
+                return self.server.execute_command('UNLINK', *names)
+            except ResponseError, e:
+                if 'unknown command' not in str(e).lower():
+                    raise
+                log.warn('redis UNLINK not supported, using DEL')
+                unlink_supported = False
+        return self.server.delete(*names)
+
     def exists(self, name, key):
         return self.server.hexists(name, key)
 
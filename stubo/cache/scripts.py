@@ -0,0 +1,90 @@
+"""
+    stubo.cache.scripts
+    ~~~~~~~~~~~~~~~~~~~
+
+    Lua scripts run on the redis master. They are loaded by SHA on first use
+    and run with EVALSHA, callers fall back to separate commands if
+    scripting is not available.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import logging
+
+from redis.exceptions import RedisError, ResponseError, NoScriptError
+
+log = logging.getLogger(__name__)
+
+# KEYS[1] request index hash, KEYS[2] response hash
+# ARGV[1] request index key, ARGV[2..n] the response keys of a stateful stub
+# The index of the request is advanced until it reaches the last response
+# and the response for it is returned, see Cache.get_response
+NEXT_RESPONSE = """
+local count = #ARGV - 1
+local index = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+if index < count then
+    index = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+end
+return redis.call('HGET', KEYS[2], ARGV[math.min(index, count) + 1])
+"""
+
+# KEYS[1] request count hash, KEYS[2] request hash
+# ARGV[1] request count key, ARGV[2] request cache limit, ARGV[3] request key,
+# ARGV[4] the encoded request
+# A new request is counted and cached only while fewer than the limit are
+# cached for the same responses, returns 1 if the request was cached, see
+# add_request
+ADD_REQUEST = """
+if redis.call('HEXISTS', KEYS[2], ARGV[3]) == 0 then
+    local count = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+    if count >= tonumber(ARGV[2]) then
+        return 0
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+end
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[4])
+return 1
+"""
+
+# script -> SHA of the scripts loaded on the master, None if scripting is
+# not available
+shas = {}
+
+
+class ScriptUnavailable(Exception):
+    """The script can not be run on the master, run the commands instead."""
+
+
+def load_script(server, script):
+    """Load the script on the server and return its SHA, or None if it could
+    not be loaded. A script the server could not be reached to load is
+    loaded on its next use."""
+    try:
+        sha = server.script_load(script)
+    except ResponseError, e:
+        log.warn('redis scripting not available, using separate commands: '
+                 '{0}'.format(e))
+        sha = None
+    except RedisError, e:
+        log.warn('unable to load redis script: {0}'.format(e))
+        return None
+    shas[script] = sha
+    return sha
+
+
+def run_script(server, script, keys, args):
+    """Run the script with EVALSHA, loading it on first use. Raises
+    ScriptUnavailable if the script can not be loaded."""
+    sha = shas[script] if script in shas else load_script(server, script)
+    if not sha:
+        raise ScriptUnavailable()
+    keys_and_args = tuple(keys) + tuple(args)
+    try:
+        return server.evalsha(sha, len(keys), *keys_and_args)
+    except NoScriptError:
+        # the script cache of the master was flushed or it failed over
+        log.info('reloading redis script {0}'.format(sha))
+        sha = load_script(server, script)
+        if not sha:
+            raise ScriptUnavailable()
+        return server.evalsha(sha, len(keys), *keys_and_args)
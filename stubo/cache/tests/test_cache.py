@@ -17,11 +17,18 @@ class Base(unittest.TestCase):
         
         self.patch_module = mock.patch('stubo.ext.module.Module', DummyModule)
         self.patch_module.start()
+
+        # there is no master to run scripts on, use the separate commands
+        from stubo.cache.scripts import NEXT_RESPONSE, ADD_REQUEST
+        self.shas_patch = mock.patch('stubo.cache.scripts.shas',
+                                     {NEXT_RESPONSE: None, ADD_REQUEST: None})
+        self.shas_patch.start()
         
     def tearDown(self):
         self.hash_patch.stop()   
         self.db_patch.stop()
         self.patch_module.stop()
+        self.shas_patch.stop()
         
     def _get_cache(self):
         from stubo.cache import Cache
@@ -60,7 +67,50 @@ class Test_create_session_cache(Base):
         self.assertEqual(stub.contains_matchers(), ["<test>match this</test>"])
         self.assertEqual(stub.response_ids(), [response_hash('<test>OK</test>', stub)])        
         self.assertEqual(self.hash.get_raw('localhost:sessions', 'bar'), 'foo')
-        
+
+    def test_new_session_compiles_plan(self):
+        self._make_scenario('localhost:foo')
+        from stubo.model.stub import create, Stub
+        stub = Stub(create('<test>match this</test>', '<test>OK</test>'),
+                    'localhost:foo')
+        doc = dict(scenario='localhost:foo', stub=stub)
+        self.scenario.insert_stub(doc, stateful=True)
+        session = self._get_cache().create_session_cache('foo', 'bar')
+        self.assertTrue(session['version'])
+        from stubo.match.plan import session_plans
+        self.assertTrue(('localhost:foo', 'bar', session['version']) in
+                        session_plans)
+        
+    def test_new_session_matcher_not_text(self):
+        self._make_scenario('localhost:foo')
+        from stubo.model.stub import create, Stub
+        stub = Stub(create([123], '<test>OK</test>'), 'localhost:foo')
+        self.scenario.insert_stub(dict(scenario='localhost:foo', stub=stub),
+                                  stateful=True)
+        session = self._get_cache().create_session_cache('foo', 'bar')
+        from stubo.match.plan import session_plans
+        plan = session_plans.get(('localhost:foo', 'bar', session['version']))
+        self.assertEqual(plan.contains_index.always, [0])
+
+    def test_new_session_classifies_stubs(self):
+        self._make_scenario('localhost:foo')
+        from stubo.model.stub import create, Stub, StubCache
+        stub = Stub(create('<test>match this</test>', '<test>OK</test>'),
+                    'localhost:foo')
+        self.scenario.insert_stub(dict(scenario='localhost:foo', stub=stub),
+                                  stateful=True)
+        stub2 = Stub(create('<test>{{1+1}}</test>', '<test>OK</test>'),
+                     'localhost:foo')
+        self.scenario.insert_stub(dict(scenario='localhost:foo', stub=stub2),
+                                  stateful=True)
+        session = self._get_cache().create_session_cache('foo', 'bar')
+        stubs = dict((x.contains_matchers()[0], x) for x in (
+            StubCache(y, 'localhost:foo', 'bar') for y in session['stubs']))
+        static = stubs['<test>match this</test>']
+        self.assertFalse(static.needs_transform('matcher'))
+        self.assertFalse(static.needs_transform('response'))
+        self.assertTrue(stubs['<test>{{1+1}}</test>'].needs_transform('matcher'))
+
     def test_new_session_with_state(self):
         scenario_name = 'foo'
         self._make_scenario('localhost:foo')
@@ -170,6 +220,34 @@ class Test_create_session_cache(Base):
         self.assertEqual(stub.module(), module)    
             
             
+    def test_lookups_once_per_name(self):
+        self._make_scenario('localhost:foo')
+        self.hash.set('localhost:delay_policy', 'slow', {"delay_type": "fixed",
+                      "name": "slow", "milliseconds": "500"})
+        from stubo.model.stub import create, Stub
+        for i in range(3):
+            stub = Stub(create('<test>match {0}</test>'.format(i),
+                               '<test>OK {0}</test>'.format(i)),
+                        'localhost:foo')
+            stub.set_module({"system_date": "2013-09-24", "version": 1,
+                             "name": "funcky"})
+            stub.set_delay_policy('slow')
+            self.scenario.insert_stub(dict(scenario='localhost:foo',
+                                           stub=stub), stateful=True)
+        with mock.patch.object(DummyModule, 'latest_version',
+                               return_value=1) as latest_version:
+            with mock.patch.object(self.hash, 'get',
+                                   wraps=self.hash.get) as get:
+                session = self._get_cache().create_session_cache('foo', 'bar')
+        self.assertEqual(latest_version.call_count, 1)
+        self.assertEqual(len([x for x in get.call_args_list
+                              if x[0][0] == 'localhost:delay_policy']), 1)
+        self.assertEqual(len(session['stubs']), 3)
+        self.assertEqual(len(self.hash._keys['localhost:foo:response']), 3)
+        self.assertEqual(session['stubs'][2]['response']['delayPolicy']['name'],
+                         'slow')
+
+
 class TestCache(unittest.TestCase):
     
     def setUp(self):
@@ -241,6 +319,35 @@ class TestCache(unittest.TestCase):
         with self.assertRaises(HTTPServerError):
             cache.get_session_with_delay('conversation', 'bogus')
             
+    def test_get_session_cached_by_version(self):
+        from stubo.cache import session_cache
+        session_cache.clear()
+        cache = self._get_cache()
+        session = {u'status': u'playback', u'session': u'joe',
+                   u'scenario': u'localhost:conversation'}
+        cache.set_session('conversation', 'joe', session)
+        hits = session_cache.hits
+        response = cache.get_session_with_delay('conversation', 'joe')[0]
+        self.assertEqual(response, session)
+        self.hash.set('localhost:conversation', 'joe', dict(session,
+                                                            system_date='x'))
+        self.assertTrue(cache.get_cached_session('conversation', 'joe') is
+                        response)
+        cache.set_session_version('conversation', 'joe')
+        self.assertEqual(cache.get_cached_session('conversation', 'joe'),
+                         dict(session, system_date='x'))
+        self.assertEqual(session_cache.hits, hits + 1)
+
+    def test_unversioned_session_not_cached(self):
+        from stubo.cache import session_cache
+        session_cache.clear()
+        cache = self._get_cache()
+        session = {u'status': u'playback', u'session': u'joe',
+                   u'scenario': u'localhost:conversation'}
+        self.hash.set('localhost:conversation', 'joe', session)
+        cache.get_cached_session('conversation', 'joe')
+        self.assertEqual(len(session_cache), 0)
+
     def test_delay_not_found(self):   
         self.assertEqual(self._get_cache().get_delay_policy('slow'), None)
         
@@ -350,10 +457,16 @@ class Test_get_response_text(unittest.TestCase):
         self.patch.start()
         self.patch2 =  mock.patch('stubo.cache.get_redis_server', lambda x: x)
         self.patch2.start()    
+        # there is no master to run scripts on, use the separate commands
+        from stubo.cache.scripts import NEXT_RESPONSE
+        self.patch3 = mock.patch('stubo.cache.scripts.shas',
+                                 {NEXT_RESPONSE: None})
+        self.patch3.start()
 
     def tearDown(self):
         self.patch.stop() 
         self.patch2.stop() 
+        self.patch3.stop()
     
     def _get_cache(self):
         from stubo.cache import Cache
@@ -380,6 +493,35 @@ class Test_get_response_text(unittest.TestCase):
         
     def test_not_found(self):
         self.assertEqual(self._func('foo', 'bar', ['1'], '2'), None)
+
+    def test_compressed(self):
+        text = "Hello {{1+1}} World " * 100
+        with mock.patch('stubo.cache.codec.compress_threshold', 100), \
+                mock.patch('stubo.cache.response_decompression', {}):
+            cache = self._get_cache()
+            cache.set_response('foo', 'bar', '1', text)
+            raw = self.hash.get_raw('localhost:foo:response', 'bar:1')
+            self.assertTrue(len(raw) < len(text))
+            self.assertEqual(self._func('foo', 'bar', ['1'], '1'), text)
+            stats = cache.get_response_compression('foo')
+        self.assertEqual(stats['responses'], 1)
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['bytes'], len(text) + 2)
+        self.assertEqual(stats['stored_bytes'], len(raw))
+        self.assertTrue(stats['ratio'] > 10)
+        self.assertEqual(stats['decompressed'], 1)
+
+    def test_with_state_script(self):
+        from stubo.cache.scripts import NEXT_RESPONSE
+        master = mock.Mock()
+        master.evalsha.return_value = '"Hello World 2"'
+        with mock.patch('stubo.cache.get_redis_master', lambda: master), \
+                mock.patch('stubo.cache.scripts.shas', {NEXT_RESPONSE: 'x'}):
+            self.assertEqual(self._func('foo', 'bar', ['1', '2'], '1'),
+                             "Hello World 2")
+        master.evalsha.assert_called_once_with(
+            'x', 2, 'localhost:foo:request_index', 'localhost:foo:response',
+            'bar:1', 'bar:1', 'bar:2')
                             
 
 class Test_add_request(Base):  
@@ -468,7 +610,90 @@ class Test_add_request(Base):
         for i in range(15):  
             self._func(session, stub, request_id='{0}'.format(i))  
         self.assertEqual(len(self.hash.get_all('localhost:foo:request')), 11)
+
+    def test_request_cache_limit_counts_session(self):
+        scenario_name = 'foo'
+        self._make_scenario('localhost:foo')
+        from stubo.model.stub import create, Stub, response_hash
+        stub = Stub(create('<test>match this</test>', '<test>OK</test>'),
+                    'localhost:foo')
+        doc = dict(scenario='localhost:foo', stub=stub)
+        self.scenario.insert_stub(doc, stateful=True)
+        cache = self._get_cache()
+        session = cache.create_session_cache('foo', 'bar')
+        for i in range(15):
+            self._func(session, stub, request_id='{0}'.format(i))
+        # the same request again is not counted twice
+        self._func(session, stub, request_id='0')
+        counts = self.hash.get_all('localhost:foo:request_count')
+        self.assertEqual(counts.values(), [10])
+        cache.delete_session_data('foo', 'bar')
+        self.assertFalse(self.hash.get_all('localhost:foo:request_count'))
                 
+class TestSessionKeyLayout(Base):
+
+    def setUp(self):
+        super(TestSessionKeyLayout, self).setUp()
+        self.layout_patch = mock.patch('stubo.cache.session_key_layout',
+                                       'session')
+        self.layout_patch.start()
+
+    def tearDown(self):
+        super(TestSessionKeyLayout, self).tearDown()
+        self.layout_patch.stop()
+
+    def _make_session(self, session_name='bar'):
+        self._make_scenario('localhost:foo')
+        from stubo.model.stub import create, Stub
+        stub = Stub(create('<test>match this</test>', '<test>OK</test>'),
+                    'localhost:foo')
+        doc = dict(scenario='localhost:foo', stub=stub)
+        self.scenario.insert_stub(doc, stateful=True)
+        session = self._get_cache().create_session_cache('foo', session_name)
+        from stubo.model.stub import StubCache
+        from stubo.cache import add_request
+        add_request(session, '1', StubCache(session['stubs'][0], 'localhost:foo',
+                    session_name), '2013-09-05', 0)
+        return session
+
+    def test_session_hashes(self):
+        self._make_session()
+        self.assertTrue(self.hash.get_all(
+            'localhost:foo:session:bar:response'))
+        self.assertTrue(self.hash.get('localhost:foo:session:bar:request',
+                                      'bar:1'))
+        self.assertFalse(self.hash.get_all('localhost:foo:request'))
+        cached = self._get_cache().get_request('foo', 'bar', '1')
+        self.assertEqual(cached[3], '2013-09-05')
+
+    def test_delete_session_data(self):
+        self._make_session()
+        self._get_cache().delete_session_data('foo', 'bar')
+        self.assertFalse([x for x in self.hash._keys if ':session:' in x])
+
+    def test_migrate(self):
+        from stubo.cache import Cache
+        self.hash.set('localhost:foo:request', 'bar:1', [['x']])
+        self.hash.set('localhost:foo:request', 'baz:1', [['y']])
+        self.hash.set('localhost:foo:response', 'bar:x', 'hello')
+        cache = Cache('localhost')
+        self.assertEqual(cache.migrate_session_data('foo', 'session'), 3)
+        self.assertFalse(self.hash.get_all('localhost:foo:request'))
+        self.assertEqual(self.hash.get('localhost:foo:session:baz:request',
+                                       'baz:1'), [['y']])
+        self.assertEqual(self.hash.get('localhost:foo:session:bar:response',
+                                       'bar:x'), 'hello')
+
+        master = DummyMaster([x for x in self.hash._keys if ':session:' in x])
+        with mock.patch('stubo.cache.get_redis_master', master):
+            self.assertEqual(cache.migrate_session_data('foo', 'scenario'), 3)
+        self.assertEqual(self.hash.get('localhost:foo:request', 'bar:1'),
+                         [['x']])
+        self.assertEqual(self.hash.get('localhost:foo:response', 'bar:x'),
+                         'hello')
+        self.assertFalse([x for x in self.hash._keys if ':session:' in x])
+
+
 class TestRequestIndex(unittest.TestCase):
     
     def setUp(self):
@@ -521,6 +746,17 @@ class TestRequestIndex(unittest.TestCase):
                     
          
 
+class TestEscapePattern(unittest.TestCase):
+
+    def test_escape(self):
+        from stubo.cache.queue import escape_pattern
+        self.assertEqual(escape_pattern('a*b?[c]'), 'a\\*b\\?\\[c\\]')
+
+    def test_plain(self):
+        from stubo.cache.queue import escape_pattern
+        self.assertEqual(escape_pattern('session_1'), 'session_1')
+
+
 class DummyModule(object):
     def __init__(self, host):
         pass
@@ -539,6 +775,10 @@ class DummyMaster(object):
     
     def keys(self, host):
         return self._keys
+
+    def scan_iter(self, match=None, count=None):
+        # glob matching as for the hash keys of the dummy hash
+        return DummyHash({'': dict.fromkeys(self._keys)}).scan('', match)
     
     def exists(self, key):
         return key in self._keys
@@ -0,0 +1,70 @@
+import unittest
+import mock
+
+from stubo.cache import codec
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_json(self):
+        value = {u'status': u'playback', u'stubs': [{u'priority': 1}]}
+        raw = codec.JSONCodec().encode(value)
+        self.assertEqual(codec.encoded_with(raw), 'json')
+        self.assertEqual(codec.decode(raw), value)
+
+    def test_encode_with_selected_codec(self):
+        with mock.patch('stubo.cache.codec.codec', codec.JSONCodec()):
+            self.assertEqual(codec.encode([1, 'x']), '[1, "x"]')
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            codec.set_codec('pickle')
+
+    @unittest.skipIf(codec.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        value = {u'status': u'playback', u'stubs': [{u'priority': 1}],
+                 u'text': u'\u2013 caf\xe9'}
+        raw = codec.MsgpackCodec().encode(value)
+        self.assertEqual(codec.encoded_with(raw), 'msgpack')
+        self.assertEqual(codec.decode(raw), value)
+
+    @unittest.skipIf(codec.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_strings_decode_as_unicode(self):
+        raw = codec.MsgpackCodec().encode({'key': 'value'})
+        self.assertEqual(codec.decode(raw), {u'key': u'value'})
+        self.assertTrue(isinstance(codec.decode(raw)['key'], unicode))
+
+    @unittest.skipIf(codec.msgpack is not None, 'msgpack is installed')
+    def test_msgpack_not_installed(self):
+        with self.assertRaises(ValueError):
+            codec.set_codec('msgpack')
+
+    def test_compress(self):
+        raw = codec.encode({u'body': u'x' * 1000})
+        with mock.patch('stubo.cache.codec.compress_threshold', 100):
+            compressed = codec.compress(raw)
+            self.assertTrue(codec.compressed(compressed))
+            self.assertTrue(len(compressed) < len(raw))
+            self.assertEqual(codec.decode(compressed), {u'body': u'x' * 1000})
+            self.assertEqual(codec.encoded_with(compressed), 'json')
+            self.assertTrue(codec.compress('"small"') == '"small"')
+
+    def test_compression_off(self):
+        raw = codec.encode(u'x' * 1000)
+        self.assertTrue(codec.compress(raw) is raw)
+
+    def test_recode_keeps_compression(self):
+        with mock.patch('stubo.cache.codec.compress_threshold', 100):
+            compressed = codec.compress(codec.encode(u'x' * 1000))
+        self.assertEqual(codec.recode(compressed), None)
+        with mock.patch('stubo.cache.codec.codec', DummyCodec()):
+            recoded = codec.recode(compressed)
+        self.assertTrue(codec.compressed(recoded))
+        self.assertEqual(codec.decode(recoded), u'dummy')
+
+
+class DummyCodec(object):
+    name = 'dummy'
+
+    def encode(self, value):
+        return '"dummy"'
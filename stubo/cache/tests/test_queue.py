@@ -1,4 +1,12 @@
 import unittest
+import mock
+
+
+class DummyCodec(object):
+    name = 'msgpack'
+
+    def encode(self, value):
+        return '\x01dummy'
 
 class HashTests(unittest.TestCase):
 
@@ -61,6 +69,47 @@ class HashTests(unittest.TestCase):
         self.assertEqual(msg_back[1], 'hello')
         self.assertEqual(msg_back[2], {'1': 'hello', '2' : [3,4]})
 
+    def test_set_many(self):
+        h = self._makeOne()
+        values = dict(('key{0}'.format(i), [i, 'hello']) for i in range(25))
+        h.set_many(self.name, values, chunk_size=10)
+        self.assertEqual(h.server.hlen(self.name), 25)
+        self.assertEqual(h.get(self.name, 'key7'), [7, 'hello'])
+
+    def test_scan(self):
+        h = self._makeOne()
+        for key in ('s1:a', 's1:b', 's10:a', 's*:a'):
+            h.set(self.name, key, 1)
+        from stubo.cache.queue import escape_pattern
+        self.assertEqual(sorted(h.scan(self.name, 's1:*', count=1)),
+                         ['s1:a', 's1:b'])
+        self.assertEqual(list(h.scan(self.name,
+                                     escape_pattern('s*') + ':*')), ['s*:a'])
+
+    def test_recode(self):
+        from stubo.cache import codec
+        h = self._makeOne()
+        h.set_raw(self.name, 'mykey', '{"1": "hello"}')
+        with mock.patch('stubo.cache.codec.codec', codec.JSONCodec()):
+            self.assertEqual(h.recode(self.name), 0)
+        with mock.patch('stubo.cache.codec.codec', DummyCodec()):
+            self.assertEqual(h.recode(self.name), 1)
+            self.assertEqual(h.get_raw(self.name, 'mykey'), '\x01dummy')
+
+    def test_unlink(self):
+        h = self._makeOne()
+        h.set(self.name, 'mykey', 1)
+        self.assertEqual(h.unlink(self.name, '_testh_missing'), 1)
+        self.assertFalse(h.server.exists(self.name))
+
+    def test_scan_keys(self):
+        from stubo.cache.queue import scan_keys
+        h = self._makeOne()
+        h.set(self.name, 'mykey', 1)
+        self.assertEqual(list(scan_keys(h.server, self.name, count=1)),
+                         [self.name])
+
+
 class QueueTests(unittest.TestCase):
 
     def _makeOne(self):
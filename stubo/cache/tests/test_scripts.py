@@ -0,0 +1,133 @@
+import unittest
+import mock
+
+
+class DummyScriptServer(object):
+
+    def __init__(self, load_error=None):
+        self.load_error = load_error
+        self.loaded = {}
+        self.calls = []
+
+    def script_load(self, script):
+        if self.load_error:
+            raise self.load_error
+        sha = 'sha{0}'.format(len(self.loaded))
+        self.loaded[sha] = script
+        return sha
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        from redis.exceptions import NoScriptError
+        if sha not in self.loaded:
+            raise NoScriptError('NOSCRIPT No matching script.')
+        self.calls.append((sha, numkeys, keys_and_args))
+        return 'result'
+
+
+class TestRunScript(unittest.TestCase):
+
+    def setUp(self):
+        self.shas_patch = mock.patch('stubo.cache.scripts.shas', {})
+        self.shas_patch.start()
+
+    def tearDown(self):
+        self.shas_patch.stop()
+
+    def test_loaded_on_first_use(self):
+        from stubo.cache.scripts import run_script, NEXT_RESPONSE
+        server = DummyScriptServer()
+        self.assertEqual(run_script(server, NEXT_RESPONSE, ['a', 'b'],
+                                    ['c']), 'result')
+        run_script(server, NEXT_RESPONSE, ['a', 'b'], ['c'])
+        self.assertEqual(server.loaded, {'sha0': NEXT_RESPONSE})
+        self.assertEqual(server.calls, [('sha0', 2, ('a', 'b', 'c'))] * 2)
+
+    def test_scripting_disabled(self):
+        from redis.exceptions import ResponseError
+        from stubo.cache.scripts import (
+            run_script, shas, ScriptUnavailable, NEXT_RESPONSE
+        )
+        server = DummyScriptServer(ResponseError("unknown command 'SCRIPT'"))
+        with self.assertRaises(ScriptUnavailable):
+            run_script(server, NEXT_RESPONSE, ['a'], [])
+        self.assertEqual(shas, {NEXT_RESPONSE: None})
+
+    def test_server_unavailable(self):
+        from redis.exceptions import ConnectionError
+        from stubo.cache.scripts import (
+            run_script, shas, ScriptUnavailable, NEXT_RESPONSE
+        )
+        server = DummyScriptServer(ConnectionError('Connection refused.'))
+        with self.assertRaises(ScriptUnavailable):
+            run_script(server, NEXT_RESPONSE, ['a'], [])
+        # loaded again on the next use
+        self.assertEqual(shas, {})
+
+    def test_reload_flushed_script(self):
+        from stubo.cache.scripts import run_script, NEXT_RESPONSE
+        server = DummyScriptServer()
+        run_script(server, NEXT_RESPONSE, ['a', 'b'], ['c'])
+        server.loaded.clear()
+        self.assertEqual(run_script(server, NEXT_RESPONSE, ['a', 'b'],
+                                    ['c']), 'result')
+
+
+class NextResponseTests(unittest.TestCase):
+
+    def setUp(self):
+        import redis
+        self.server = redis.Redis('localhost')
+        self.shas_patch = mock.patch('stubo.cache.scripts.shas', {})
+        self.shas_patch.start()
+        self.server.hmset('_test_response', {'s:1': '"one"', 's:2': '"two"'})
+
+    def tearDown(self):
+        self.server.delete('_test_response', '_test_request_index')
+        self.shas_patch.stop()
+
+    def _next(self):
+        from stubo.cache.scripts import run_script, NEXT_RESPONSE
+        return run_script(self.server, NEXT_RESPONSE,
+                          ['_test_request_index', '_test_response'],
+                          ['s:x', 's:1', 's:2'])
+
+    def test_advances_to_last_response(self):
+        self.assertEqual([self._next() for _ in range(3)],
+                         ['"one"', '"two"', '"two"'])
+        self.assertEqual(self.server.hget('_test_request_index', 's:x'), '2')
+
+    def test_reset_index(self):
+        self._next()
+        self.server.hset('_test_request_index', 's:x', 0)
+        self.assertEqual(self._next(), '"one"')
+
+
+class AddRequestTests(unittest.TestCase):
+
+    def setUp(self):
+        import redis
+        self.server = redis.Redis('localhost')
+        self.shas_patch = mock.patch('stubo.cache.scripts.shas', {})
+        self.shas_patch.start()
+
+    def tearDown(self):
+        self.server.delete('_test_request_count', '_test_request')
+        self.shas_patch.stop()
+
+    def _add(self, request_key):
+        from stubo.cache.scripts import run_script, ADD_REQUEST
+        return run_script(self.server, ADD_REQUEST,
+                          ['_test_request_count', '_test_request'],
+                          ['s:x', 2, request_key, '"request"'])
+
+    def test_limit(self):
+        self.assertEqual([self._add('s:{0}'.format(i)) for i in range(3)],
+                         [1, 1, 0])
+        self.assertEqual(sorted(self.server.hkeys('_test_request')),
+                         ['s:0', 's:1'])
+        self.assertEqual(self.server.hget('_test_request_count', 's:x'), '2')
+
+    def test_cached_request_not_counted(self):
+        self._add('s:0')
+        self.assertEqual(self._add('s:0'), 1)
+        self.assertEqual(self.server.hget('_test_request_count', 's:x'), '1')
@@ -32,6 +32,16 @@ class Hooks(object):
         """ Factory method to create an instance of :class:`~stubo.ext.transformer.TransformerBase`
         
         :Params:
-          - `stub`: stub to transform, see :class:`~stubo.model.stub.Stub`
+          - `stub`: stub to transform, see :class:`~stubo.model.stub.Stub`.
+            It is a copy of the session stub so may be changed in place.
         """
         pass
+
+    def transforms_static_stubs(self):
+        """ Return True if the transformer may change a stub that has no user
+        exit module and no template syntax in its matchers or response.
+        
+        Static stubs are indexed at session load time and can skip the
+        transformer, override to return False if that is safe for this hook.
+        """
+        return True
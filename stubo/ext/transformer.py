@@ -3,7 +3,8 @@
     :license: GPLv3, see LICENSE for more details.
 """
 import logging
-from lxml import etree
+import copy
+
 from stubo.utils import as_date, compact_traceback, run_template
 from stubo.exceptions import TransformError
 from stubo.ext import roll_date, parse_xml, today_str
@@ -22,6 +23,12 @@ class StuboDefaultHooks(Hooks):
                                              stub.module().get('version'))
         return Transformer(stub, module)
 
+    def transforms_static_stubs(self):
+        # only the default transformer is known to leave static stubs alone,
+        # a subclass may apply a user exit or template processor to any stub
+        return (type(self).make_transformer.__func__ is not
+                StuboDefaultHooks.make_transformer.__func__)
+
 
 def transform(stub, request, **kwargs):
     function = kwargs['function']
@@ -97,13 +104,16 @@ class TransformerBase(object):
         return self.template_processor.eval_text(templ, request, **kwargs)
 
     def transform(self, request, **kwargs):
-        stub = self.stub
+        # the stub and request may be shared with the caller, the stub copy
+        # only copies its payload when it is changed
+        stub = self.stub.copy()
+        request = copy.copy(request)
         trace = kwargs['trace']
         context = dict(stub=stub, template_processor=self.template_processor)
         try:
-            # if the request is XML parse and make it available for templates 
-            xmltree = etree.fromstring(request.request_body())
-            context['xmltree'] = xmltree
+            # if the request is XML make the parsed tree available for
+            # templates, the tree is shared with the request matchers
+            context['xmltree'] = request.request_body_xml()
         except Exception:
             pass
         context.update(kwargs)
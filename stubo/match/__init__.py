@@ -11,11 +11,11 @@ import logging
 import copy
 
 from hamcrest.core.string_description import StringDescription
-from hamcrest import all_of, is_not
+from hamcrest import all_of
 
-from .request_matcher import (
-    body_contains, has_method, has_path, has_query_args, has_url_pattern,
-    body_xpath, body_jsonpath, has_headers
+from .plan import (
+    build_matchers, build_predicate, get_session_plan, unmatched_request_key,
+    unmatched_requests
 )
 from stubo.model.stub import StubCache
 from stubo.exceptions import exception_response
@@ -24,62 +24,14 @@ from stubo.ext.transformer import transform
 log = logging.getLogger(__name__)
 
 
-def build_matchers(stub):
-    matchers = []
-    for k, v in stub.request().iteritems():
-        if k == 'bodyPatterns':
-            body_patterns = stub.request()['bodyPatterns']
-            for body_pattern, body_pattern_value in body_patterns.iteritems():
-                # bodyPatterns is a list
-                for s in body_pattern_value:
-                    if body_pattern == 'contains':
-                        matchers.append(body_contains(s))
-                    elif body_pattern == '!contains':
-                        matchers.append(is_not(body_contains(s)))
-                    elif body_pattern == 'xpath':
-                        namespaces = None
-                        if isinstance(s, tuple):
-                            s, namespaces = s
-                        matchers.append(body_xpath(s, namespaces))
-                    elif body_pattern == '!xpath':
-                        namespaces = None
-                        if isinstance(s, tuple):
-                            s, namespaces = s
-                        matchers.append(is_not(body_xpath(s, namespaces)))
-                    elif body_pattern == 'jsonpath':
-                        matchers.append(body_jsonpath(s))
-                    elif body_pattern == '!jsonpath':
-                        matchers.append(is_not(body_jsonpath(s)))
-
-        elif k == 'method':
-            matchers.append(has_method(v))
-        elif k == 'urlPath':
-            matchers.append(has_path(v))
-        elif k == 'urlPattern':
-            matchers.append(has_url_pattern(v))
-        elif k == 'queryArgs':
-            matchers.append(has_query_args(v))
-        elif k == '!method':
-            matchers.append(is_not(has_method(v)))
-        elif k == '!urlPath':
-            matchers.append(is_not(has_path(v)))
-        elif k == '!queryArgs':
-            matchers.append(is_not(has_query_args(v)))
-        elif k == '!urlPattern':
-            matchers.append(is_not(has_url_pattern(v)))
-        elif k == 'headers':
-            matchers.append(has_headers(v))
-        elif k == '!headers':
-            matchers.append(is_not(has_headers(v)))
-    return matchers
-
-
 def match(request, session, trace, system_date, url_args, hooks,
-          module_system_date=None):
+          module_system_date=None, parallel=None):
     """Returns the stats of a request match process
     :param request: source stubo request
     :param session: cached session payload associated with this request
     :param module_system_date: optional system date of an external module
+    :param parallel: optional :class:`~stubo.match.parallel.ParallelMatcher`
+      for large sessions
     """
     request_text = request.request_body()
     scenario_key = session['scenario']
@@ -97,39 +49,97 @@ def match(request, session, trace, system_date, url_args, hooks,
                                  title="no stubs found in session {0} for {1}, status={2}".format(
                                      session_name, scenario_key, session.get('status')))
 
+    plan = get_session_plan(session)
     stub_count = len(session['stubs'])
-    trace.info(u'matching against {0} stubs'.format(stub_count))
-    for stub_number in range(stub_count):
+    transforms_static_stubs = hooks.transforms_static_stubs()
+    unmatched_key = None
+    hit_order = None
+    if transforms_static_stubs:
+        candidates = range(stub_count)
+    else:
+        unmatched_key = unmatched_request_key(plan, request)
+        if unmatched_key and unmatched_requests.get(unmatched_key):
+            trace.info('request did not match any stubs in this session '
+                       'version before')
+            return (False,)
+        hit_order = plan.hit_order
+        candidates = plan.exact_candidates(request)
+        if candidates is not None:
+            trace.info('request body is the recorded body of stub ({0})'.format(
+                candidates[-1]))
+        else:
+            candidates = plan.candidates(request)
+            if hit_order:
+                candidates = hit_order.order(candidates)
+    trace.info(u'matching against {0} of {1} stubs'.format(len(candidates),
+                                                           stub_count))
+    if parallel and not transforms_static_stubs \
+            and parallel.accepts(plan, candidates, trace):
+        stub_number = parallel.match(plan, candidates, request)
+        if stub_number is not None:
+            if hit_order:
+                hit_order.record(stub_number,
+                                 candidates.index(stub_number) + 1)
+            return True, stub_number, StubCache(session['stubs'][stub_number],
+                                                scenario_key, session_name,
+                                                copy_on_write=True)
+        # all the candidates have been tried
+        candidates = []
+    for depth, stub_number in enumerate(candidates, 1):
         trace.info('stub ({0})'.format(stub_number))
-        stub = StubCache(session['stubs'][stub_number], scenario_key,
-                         session_name)
-        source_stub = copy.deepcopy(stub)
-        request_copy = copy.deepcopy(request)
-        stub, request_copy = transform(stub,
-                                       request_copy,
-                                       module_system_date=module_system_date,
-                                       system_date=system_date,
-                                       function='get/response',
-                                       cache=session.get('ext_cache'),
-                                       hooks=hooks,
-                                       stage='matcher',
-                                       trace=trace,
-                                       url_args=url_args)
-        trace.info('finished transformation')
-        if source_stub != stub:
-            trace.diff('stub ({0}) was transformed'.format(stub_number),
-                       source_stub.payload, stub.payload)
-            trace.info('stub ({0}) was transformed into'.format(stub_number),
-                       stub.payload)
-        if request_copy != request:
-            trace.diff('request was transformed', request_copy.request_body(),
-                       request.request_body())
-            trace.info('request was transformed into', request_copy.request_body())
+        source_payload = session['stubs'][stub_number]
+        if transforms_static_stubs or source_payload.get('module'):
+            # custom hooks and user exits may change the stub in place, the
+            # session is shared by the requests of this worker
+            stub = StubCache(copy.deepcopy(source_payload), scenario_key,
+                             session_name)
+        else:
+            # the stub shares the session payload until it is transformed
+            stub = StubCache(source_payload, scenario_key, session_name,
+                             copy_on_write=True)
+        stub_request = request
+        stub_transformed = False
+        # static stubs were classified when the session was loaded
+        if transforms_static_stubs or stub.needs_transform('matcher'):
+            stub, stub_request = transform(stub,
+                                           request,
+                                           module_system_date=module_system_date,
+                                           system_date=system_date,
+                                           function='get/response',
+                                           cache=session.get('ext_cache'),
+                                           hooks=hooks,
+                                           stage='matcher',
+                                           trace=trace,
+                                           url_args=url_args)
+            trace.info('finished transformation')
+            stub_transformed = stub.payload is not source_payload \
+                and stub.payload != source_payload
+            if stub_transformed:
+                trace.diff('stub ({0}) was transformed'.format(stub_number),
+                           source_payload, stub.payload)
+                trace.info('stub ({0}) was transformed into'.format(stub_number),
+                           stub.payload)
+            if stub_request.request_body() is not request.request_body() \
+                    and stub_request != request:
+                trace.diff('request was transformed', stub_request.request_body(),
+                           request.request_body())
+                trace.info('request was transformed into', stub_request.request_body())
 
         matcher = StubMatcher(trace)
-        if matcher.match(request_copy, stub):
+        # a transformed stub may have new matchers so can't use the plan
+        if stub_transformed:
+            matched = matcher.match(stub_request, stub)
+        else:
+            matched = matcher.match(stub_request, stub,
+                                    plan.matchers(stub_number),
+                                    plan.predicate(stub_number))
+        if matched:
+            if hit_order:
+                hit_order.record(stub_number, depth)
             return True, stub_number, stub
 
+    if unmatched_key:
+        unmatched_requests.set(unmatched_key, True)
     return (False,)
 
 
@@ -137,10 +147,20 @@ class StubMatcher(object):
     def __init__(self, trace):
         self.trace = trace
 
-    def match(self, request, stub):
-        """Match request with single stub"""
+    def match(self, request, stub, matchers=None, predicate=None):
+        """Match request with single stub
+        :param matchers: optional precompiled matchers for the stub
+        :param predicate: optional precompiled predicate for the matchers
+        """
+        if matchers is None:
+            matchers = build_matchers(stub)
+        if not self.trace.full_tracking:
+            # mismatches are only described for full tracking
+            if predicate is None:
+                predicate = build_predicate(matchers)
+            return predicate(request)
         msg = StringDescription()
-        all = all_of(*build_matchers(stub))
+        all = all_of(*matchers)
         result = all.matches(request, msg)
         if not result:
             log.debug(u'No match found: {0}'.format(msg.out))
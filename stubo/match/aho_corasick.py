@@ -0,0 +1,78 @@
+"""
+    stubo.match.aho_corasick
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Aho-Corasick multi pattern string search.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+from collections import deque
+
+
+class Automaton(object):
+    """Finds which of a set of patterns occur in a text in a single pass.
+
+    .. code-block:: python
+
+        automaton = Automaton()
+        automaton.add(u'he', 1)
+        automaton.add(u'she', 2)
+        automaton.build()
+        automaton.search(u'ushers')  # set([1, 2])
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.built = False
+
+    def add(self, pattern, value):
+        if not pattern:
+            raise ValueError('empty patterns can not be searched for')
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = next_state
+        self.out[state] += (value,)
+        self.built = False
+
+    def build(self):
+        """Compute the failure links, must be called before searching."""
+        goto, fail, out = self.goto, self.fail, self.out
+        queue = deque(goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in goto[state].iteritems():
+                queue.append(next_state)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0)
+                out[next_state] += out[fail[next_state]]
+        self.built = True
+        return self
+
+    def search(self, text):
+        """Return the set of values for all patterns found in text, which
+        may be any iterable of characters."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    def __len__(self):
+        return len(self.goto)
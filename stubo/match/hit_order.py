@@ -0,0 +1,116 @@
+"""
+    stubo.match.hit_order
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Adaptive stub ordering for sessions begun with ``adaptive_order=true``.
+
+    Stubs are tried in session order and the first match wins. Two stubs
+    can change places without changing which stub a request matches if no
+    request can match both of them. The hit counts of a session are used to
+    periodically move hot stubs in front of such stubs of the same priority.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import threading
+
+# matches between reorders of a session
+REORDER_INTERVAL = 1000
+
+# only the hottest stubs are moved forward on a reorder
+REORDER_HOT_STUBS = 100
+
+
+def discriminators(payload):
+    """Return the exact values a request must have to match the stub."""
+    request = payload.get('request', {})
+    values = {}
+    for key in ('method', 'urlPath'):
+        if key in request:
+            values[key] = request[key]
+    for key in ('queryArgs', 'headers'):
+        spec = request.get(key)
+        if isinstance(spec, dict):
+            values.update(((key, k), v) for k, v in spec.iteritems())
+    return values
+
+
+def disjoint(a, b):
+    """Return True if no request can match stubs with both discriminators."""
+    return any(k in b and b[k] != v for k, v in a.iteritems())
+
+
+class HitOrder(object):
+    """Hit counts for the stubs of a session and the order to try them in.
+
+    A reorder only swaps neighbouring stubs with the same priority and
+    disjoint discriminators, so any two stubs that could match the same
+    request are always tried in session order. Stubs that may be transformed
+    before matching are never moved.
+    """
+
+    def __init__(self, payloads, dynamic, interval=REORDER_INTERVAL):
+        count = len(payloads)
+        self.interval = interval
+        self.hits = [0] * count
+        # position of each stub in the match order
+        self.rank = range(count)
+        self.priorities = [x.get('priority') for x in payloads]
+        self.discriminators = [None if dynamic[i] else discriminators(x)
+                               for i, x in enumerate(payloads)]
+        self.matches = 0
+        self.depth = 0
+        self.total_matches = 0
+        self.total_depth = 0
+        self.reorders = 0
+        self._lock = threading.Lock()
+
+    def order(self, candidates):
+        """Return the candidate stub numbers in the order to try them."""
+        return sorted(candidates, key=self.rank.__getitem__)
+
+    def record(self, stub_number, depth):
+        """Count a match of the stub after trying depth stubs."""
+        with self._lock:
+            self.hits[stub_number] += 1
+            self.matches += 1
+            self.depth += depth
+            self.total_matches += 1
+            self.total_depth += depth
+            if self.matches >= self.interval:
+                self.reorder()
+
+    def swappable(self, a, b):
+        da, db = self.discriminators[a], self.discriminators[b]
+        return da is not None and db is not None and \
+            self.priorities[a] == self.priorities[b] and disjoint(da, db)
+
+    def reorder(self):
+        hits = self.hits
+        rank = list(self.rank)
+        order = sorted(range(len(rank)), key=rank.__getitem__)
+        hot = sorted((x for x in range(len(hits)) if hits[x]),
+                     key=lambda x: -hits[x])[:REORDER_HOT_STUBS]
+        for stub_number in hot:
+            i = rank[stub_number]
+            while i > 0:
+                previous = order[i - 1]
+                if hits[previous] >= hits[stub_number] or \
+                        not self.swappable(previous, stub_number):
+                    break
+                order[i - 1], order[i] = stub_number, previous
+                rank[stub_number], rank[previous] = i - 1, i
+                i -= 1
+        self.rank = rank
+        self.reorders += 1
+        self.matches = self.depth = 0
+
+    def stats(self):
+        def average(depth, matches):
+            return round(float(depth) / matches, 2) if matches else 0
+
+        return dict(reorders=self.reorders,
+                    matches=self.total_matches,
+                    average_scan_depth=average(self.total_depth,
+                                               self.total_matches),
+                    recent_average_scan_depth=average(self.depth, self.matches))
@@ -0,0 +1,90 @@
+"""
+    stubo.match.parallel
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Parallel matching of large sessions on a process pool.
+
+    The candidate stubs are split into chunks which are matched in worker
+    processes, the lowest matching stub number wins so the result is the
+    same as a serial scan. Only sessions with no stubs that need transforming
+    are matched in parallel, the matchers of those depend on the request alone.
+
+    Workers keep their own plan for each session version. A worker that has
+    not seen a session version asks for it and is sent the compact form of the
+    stubs, the request part of each stub.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import logging
+
+from .plan import SessionPlan, session_plans
+
+log = logging.getLogger(__name__)
+
+# returned by a worker that does not have the plan for a session version
+MISSING_PLAN = 'missing_plan'
+
+
+def compact_stubs(plan):
+    """Return the part of the session stubs the workers need to match."""
+    return tuple(dict(request=x.get('request', {})) for x in plan.payloads)
+
+
+def match_chunk(key, stub_numbers, request, stubs=None):
+    """Return the first of the stub numbers whose stub matches the request,
+    None if none match or MISSING_PLAN if the stubs of the session version
+    are needed. Runs in a worker process."""
+    plan = session_plans.get(key)
+    if plan is None:
+        if stubs is None:
+            return MISSING_PLAN
+        scenario, session_name, version = key
+        plan = SessionPlan(dict(scenario=scenario, session=session_name,
+                                version=version, stubs=list(stubs)))
+        session_plans.set(key, plan)
+    for stub_number in stub_numbers:
+        if plan.predicate(stub_number)(request):
+            return stub_number
+
+
+class ParallelMatcher(object):
+    """Matches the candidates of sessions with at least ``threshold``
+    candidate stubs in chunks on a process pool."""
+
+    def __init__(self, executor, workers, threshold, chunk_size=None):
+        self.executor = executor
+        self.workers = workers
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+
+    def accepts(self, plan, candidates, trace):
+        # mismatches are only described by a serial scan
+        return bool(plan.key and plan.static and not trace.full_tracking and
+                    len(candidates) >= self.threshold)
+
+    def chunks(self, candidates):
+        size = self.chunk_size or -(-len(candidates) // self.workers)
+        return [candidates[i:i + size] for i in range(0, len(candidates), size)]
+
+    def match(self, plan, candidates, request):
+        """Return the lowest candidate stub number that matches the request
+        or None if none match."""
+        chunks = self.chunks(candidates)
+        futures = [self.executor.submit(match_chunk, plan.key, x, request)
+                   for x in chunks]
+        try:
+            for chunk, future in zip(chunks, futures):
+                result = future.result()
+                if result == MISSING_PLAN:
+                    log.debug('sending stubs for {0} to worker'.format(
+                        plan.key))
+                    result = self.executor.submit(match_chunk, plan.key, chunk,
+                                                  request,
+                                                  compact_stubs(plan)).result()
+                if result is not None:
+                    return result
+        finally:
+            # the chunks after a match are not needed
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,518 @@
+"""
+    stubo.match.plan
+    ~~~~~~~~~~~~~~~~
+
+    Compiled matcher plans.
+
+    Building the hamcrest matchers for a stub compiles regexes and jsonpath
+    expressions, so the matchers for each session are built once and kept
+    in a per worker cache keyed by the session and its version stamp.
+
+    A compiled plan also indexes the stubs ``contains`` matchers, methods,
+    url paths, query args and url patterns so that only the stubs that could
+    match a request are evaluated in full. Stubs recorded from a whole request
+    body are also found by a hash of the body.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import logging
+import re
+from collections import defaultdict
+from itertools import chain
+
+from hamcrest import is_not
+from hamcrest.core.core.isnot import IsNot
+
+from .request_matcher import (
+    body_contains, has_method, has_path, has_query_args, has_url_pattern,
+    body_xpath, body_jsonpath, has_headers
+)
+from .aho_corasick import Automaton
+from .hit_order import HitOrder
+from stubo.model.stub import Stub
+from stubo.utils import strip_whitespace, compute_hash
+from stubo.utils.lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+# compiled session plans for this worker process
+session_plans = LRUCache(maxsize=100)
+
+# requests that matched no stub in a static session version, see
+# unmatched_request_key
+unmatched_requests = LRUCache(maxsize=10000)
+
+# the default transformer only evaluates a template in the matcher stage for
+# stubs with a single contains matcher
+TEMPLATE_MARKERS = (u'{{', u'{%', u'{#')
+
+# long contains matchers are indexed by a few windows of this size to bound
+# the size of the automaton
+CONTAINS_KEY_SIZE = 32
+
+
+def build_matchers(stub):
+    matchers = []
+    for k, v in stub.request().iteritems():
+        if k == 'bodyPatterns':
+            body_patterns = stub.request()['bodyPatterns']
+            for body_pattern, body_pattern_value in body_patterns.iteritems():
+                # bodyPatterns is a list
+                for s in body_pattern_value:
+                    if body_pattern == 'contains':
+                        matchers.append(body_contains(s))
+                    elif body_pattern == '!contains':
+                        matchers.append(is_not(body_contains(s)))
+                    elif body_pattern == 'xpath':
+                        namespaces = None
+                        if isinstance(s, tuple):
+                            s, namespaces = s
+                        matchers.append(body_xpath(s, namespaces))
+                    elif body_pattern == '!xpath':
+                        namespaces = None
+                        if isinstance(s, tuple):
+                            s, namespaces = s
+                        matchers.append(is_not(body_xpath(s, namespaces)))
+                    elif body_pattern == 'jsonpath':
+                        matchers.append(body_jsonpath(s))
+                    elif body_pattern == '!jsonpath':
+                        matchers.append(is_not(body_jsonpath(s)))
+
+        elif k == 'method':
+            matchers.append(has_method(v))
+        elif k == 'urlPath':
+            matchers.append(has_path(v))
+        elif k == 'urlPattern':
+            matchers.append(has_url_pattern(v))
+        elif k == 'queryArgs':
+            matchers.append(has_query_args(v))
+        elif k == '!method':
+            matchers.append(is_not(has_method(v)))
+        elif k == '!urlPath':
+            matchers.append(is_not(has_path(v)))
+        elif k == '!queryArgs':
+            matchers.append(is_not(has_query_args(v)))
+        elif k == '!urlPattern':
+            matchers.append(is_not(has_url_pattern(v)))
+        elif k == 'headers':
+            matchers.append(has_headers(v))
+        elif k == '!headers':
+            matchers.append(is_not(has_headers(v)))
+    return matchers
+
+
+def _predicate(matcher):
+    if isinstance(matcher, IsNot):
+        cost, test = _predicate(matcher.matcher)
+        return cost, lambda request: not test(request)
+    return getattr(matcher, 'cost', 1), getattr(matcher, '_matches',
+                                                matcher.matches)
+
+
+def build_predicate(matchers):
+    """Return a function of a request that is True if all of the matchers
+    match. The matchers are evaluated cheapest first and stop at the first
+    mismatch without building hamcrest descriptions."""
+    tests = tuple(x[1] for x in sorted((_predicate(x) for x in matchers),
+                                       key=lambda x: x[0]))
+
+    def predicate(request):
+        for test in tests:
+            if not test(request):
+                return False
+        return True
+
+    return predicate
+
+
+def contains_matchers(payload):
+    return payload.get('request', {}).get('bodyPatterns', {}).get('contains') or []
+
+
+def has_template(text):
+    return isinstance(text, basestring) and any(x in text for x in TEMPLATE_MARKERS)
+
+
+def needs_matcher_transform(payload):
+    """Return True if the default transformer can change the stub or request
+    in the matcher stage, either via a user exit module or a template."""
+    if payload.get('module'):
+        return True
+    contains = contains_matchers(payload)
+    return len(contains) == 1 and has_template(contains[0])
+
+
+def needs_response_transform(payload):
+    """Return True if the default transformer can change any of the stub
+    responses, either via a user exit module or a template."""
+    if payload.get('module'):
+        return True
+    bodys = payload.get('response', {}).get('body')
+    if not isinstance(bodys, list):
+        bodys = [bodys]
+    return any(has_template(x) for x in bodys)
+
+
+def classify_stub(payload):
+    """Return the transform stages the stub needs, see
+    :meth:`~stubo.model.stub.StubData.needs_transform`."""
+    return dict(matcher=needs_matcher_transform(payload),
+                response=needs_response_transform(payload))
+
+
+def contains_keys(text):
+    """Return substrings of a normalised contains matcher to index it by.
+    If the matcher is found in a body then so are all of its keys."""
+    size = CONTAINS_KEY_SIZE
+    if len(text) <= 3 * size:
+        return [text] if text else []
+    middle = (len(text) - size) // 2
+    return [text[:size], text[middle:middle + size], text[-size:]]
+
+
+class ContainsIndex(object):
+    """Multi pattern index over the contains matchers of a session. A single
+    pass over a request body finds the stubs whose contains matchers could
+    all be satisfied. Stubs that may be transformed before matching are
+    always candidates."""
+
+    def __init__(self, payloads, dynamic):
+        self.automaton = Automaton()
+        self.stubs_by_key = []
+        self.required = {}
+        self.always = []
+        key_ids = {}
+        for stub_number, payload in enumerate(payloads):
+            keys = set()
+            contains = contains_matchers(payload)
+            # a matcher that isn't text is left for the match to report
+            if not dynamic[stub_number] and \
+                    all(isinstance(x, basestring) for x in contains):
+                for text in contains:
+                    keys.update(contains_keys(strip_whitespace(text)))
+            if not keys:
+                self.always.append(stub_number)
+                continue
+            for key in keys:
+                key_id = key_ids.get(key)
+                if key_id is None:
+                    key_id = key_ids[key] = len(self.stubs_by_key)
+                    self.stubs_by_key.append([])
+                    self.automaton.add(key, key_id)
+                self.stubs_by_key[key_id].append(stub_number)
+            self.required[stub_number] = len(keys)
+        self.automaton.build()
+
+    def candidates(self, normalised_chunks):
+        """Return the sorted stub numbers that could match the body, given
+        in whitespace free chunks."""
+        found = defaultdict(int)
+        for key_id in self.automaton.search(chain.from_iterable(
+                normalised_chunks)):
+            for stub_number in self.stubs_by_key[key_id]:
+                found[stub_number] += 1
+        required = self.required
+        result = [x for x, count in found.iteritems() if count == required[x]]
+        result.extend(self.always)
+        result.sort()
+        return result
+
+
+def exact_body_matcher(payload):
+    """Return the whitespace free contains matcher of a stub that only
+    matches a method and a single contains matcher, as recorded from a whole
+    request body, else None."""
+    request = payload.get('request', {})
+    if not set(request) <= set(['method', 'bodyPatterns']) or \
+            not isinstance(request.get('method', u''), basestring):
+        return None
+    patterns = request.get('bodyPatterns') or {}
+    contains = patterns.get('contains')
+    if set(patterns) != set(['contains']) or not isinstance(contains, list) \
+            or len(contains) != 1 or not isinstance(contains[0], basestring):
+        return None
+    return strip_whitespace(contains[0]) or None
+
+
+def could_match_body(payload, method, normalised):
+    """Return False if the stub can not match any request with the method,
+    None for any method, and the whitespace free body."""
+    request = payload.get('request', {})
+    if method is not None and request.get('method', method) != method:
+        return False
+    patterns = request.get('bodyPatterns') or {}
+    for text in patterns.get('contains') or []:
+        if isinstance(text, basestring) and \
+                strip_whitespace(text) not in normalised:
+            return False
+    for text in patterns.get('!contains') or []:
+        if isinstance(text, basestring) and strip_whitespace(text) in normalised:
+            return False
+    return True
+
+
+class FingerprintIndex(object):
+    """Finds the stubs recorded from a whole request body by a hash of the
+    body with its whitespace removed, see exact_body_matcher.
+
+    Such a stub matches any request with its method and body, but a stub
+    before it in the session may match the request too and must win. The
+    stubs that can't be ruled out from the body and method alone are found
+    once when the session is compiled and evaluated first."""
+
+    def __init__(self, payloads, dynamic, contains_index):
+        # (method, fingerprint) => the stub numbers to evaluate in order
+        self.stubs = {}
+        for stub_number, payload in enumerate(payloads):
+            if dynamic[stub_number]:
+                continue
+            normalised = exact_body_matcher(payload)
+            if normalised is None:
+                continue
+            method = payload['request'].get('method')
+            key = method, compute_hash(normalised)
+            if key in self.stubs:
+                # the first stub with the body always wins
+                continue
+            earlier = (x for x in contains_index.candidates([normalised])
+                       if x < stub_number)
+            self.stubs[key] = [x for x in earlier if dynamic[x] or
+                               could_match_body(payloads[x], method, normalised)]
+            self.stubs[key].append(stub_number)
+
+    def candidates(self, request):
+        """Return the stub numbers that decide the match of the request if
+        it has the body of a recorded stub, else None."""
+        if not self.stubs:
+            return None
+        fingerprint = request.request_body_fingerprint()
+        found = [x for x in (self.stubs.get((request.method, fingerprint)),
+                             self.stubs.get((None, fingerprint))) if x]
+        if not found:
+            return None
+        return min(found, key=lambda x: x[-1])
+
+
+class DiscriminatorIndex(object):
+    """Buckets the stubs of a session by their exact method and urlPath.
+    Stubs without one of them, e.g. stubs with a urlPattern or a negated
+    matcher, fall back to a wildcard for it. Stubs with queryArgs are only
+    candidates for requests with all of their query arg keys. Stubs that may
+    be transformed before matching are always candidates."""
+
+    def __init__(self, payloads, dynamic):
+        self.buckets = defaultdict(list)
+        self.required_query = {}
+        for stub_number, payload in enumerate(payloads):
+            request = payload.get('request', {})
+            if dynamic[stub_number]:
+                self.buckets[(None, None)].append(stub_number)
+                continue
+            key = (request.get('method'), request.get('urlPath'))
+            self.buckets[key].append(stub_number)
+            query_args = request.get('queryArgs')
+            if query_args and isinstance(query_args, dict):
+                self.required_query[stub_number] = frozenset(query_args)
+        self.buckets = dict(self.buckets)
+        # nothing to discriminate on if every stub is in the wildcard bucket
+        self.discriminates = bool(self.required_query) or \
+            any(x != (None, None) for x in self.buckets)
+
+    def candidates(self, request):
+        """Return the set of stub numbers that could match the method, path
+        and query of the request or None if all stubs could."""
+        if not self.discriminates:
+            return None
+        buckets = self.buckets
+        method, path = request.method, request.path
+        result = set()
+        for key in set([(method, path), (method, None), (None, path),
+                        (None, None)]):
+            result.update(buckets.get(key, ()))
+        if self.required_query:
+            query_keys = frozenset(request.request_query_args())
+            required = self.required_query
+            result = set(x for x in result
+                         if x not in required or required[x] <= query_keys)
+        return result
+
+
+# python limits the number of named groups in a regex
+URL_PATTERN_CHUNK_SIZE = 99
+
+# patterns that can't be combined with others in one regex: back references
+# and named groups clash with the combined groups, inline flags apply to
+# the whole regex and conditionals refer to group numbers
+STANDALONE_URL_PATTERN = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]|\(\?\(')
+
+
+class UrlPatternIndex(object):
+    """Combines the urlPattern regexes of a session into a few regexes so one
+    scan of a request path finds all the stubs whose url pattern matches.
+
+    Each pattern becomes an optional lookahead with a named group for its
+    stub, ``(?:(?=[\s\S]*?(?P<s3>pattern))|)``, which is equivalent to
+    searching the path for the pattern. Patterns that can't be combined are
+    searched for separately. Stubs without a urlPattern and stubs that may
+    be transformed before matching are always candidates."""
+
+    def __init__(self, payloads, dynamic):
+        self.combined = []
+        self.standalone = []
+        self.patterned = set()
+        combinable = []
+        for stub_number, payload in enumerate(payloads):
+            pattern = payload.get('request', {}).get('urlPattern')
+            if dynamic[stub_number] or not isinstance(pattern, basestring):
+                continue
+            try:
+                regex = re.compile(pattern)
+            except re.error:
+                # leave it to the stub matcher to report
+                continue
+            self.patterned.add(stub_number)
+            if STANDALONE_URL_PATTERN.search(pattern):
+                self.standalone.append((stub_number, regex))
+            else:
+                combinable.append((stub_number, pattern))
+        size = URL_PATTERN_CHUNK_SIZE
+        for i in range(0, len(combinable), size):
+            chunk = combinable[i:i + size]
+            try:
+                self.combined.append(re.compile(u''.join(
+                    ur'(?:(?=[\s\S]*?(?P<s{0}>{1}))|)'.format(*x) for x in chunk)))
+            except re.error:
+                self.standalone.extend((x, re.compile(y)) for x, y in chunk)
+
+    def excluded(self, request):
+        """Return the set of stub numbers whose url pattern does not match
+        the request path."""
+        if not self.patterned:
+            return frozenset()
+        path = request.path
+        matched = set()
+        if isinstance(path, basestring):
+            for regex in self.combined:
+                groups = regex.match(path).groupdict()
+                matched.update(int(k[1:]) for k, v in groups.iteritems()
+                               if v is not None)
+            matched.update(x for x, regex in self.standalone
+                           if regex.search(path))
+        return self.patterned - matched
+
+
+def session_plan_key(session):
+    """Return the plan cache key for a session or None if the session
+    has not been stamped with a version by create_session_cache."""
+    version = session.get('version')
+    if not version:
+        return None
+    return session['scenario'], session['session'], version
+
+
+class SessionPlan(object):
+    """Matchers for each stub in a session, compiled on first use."""
+
+    def __init__(self, session):
+        self.key = session_plan_key(session)
+        self.scenario = session['scenario']
+        self.payloads = session.get('stubs') or []
+        self._matchers = [None] * len(self.payloads)
+        self._predicates = [None] * len(self.payloads)
+        self.contains_index = None
+        self.discriminator_index = None
+        self.url_pattern_index = None
+        self.fingerprint_index = None
+        # True if none of the stubs can be transformed before matching
+        self.static = False
+        self.adaptive_order = bool(session.get('adaptive_order'))
+        self.hit_order = None
+
+    def matchers(self, stub_number):
+        matchers = self._matchers[stub_number]
+        if matchers is None:
+            stub = Stub(self.payloads[stub_number], self.scenario)
+            matchers = self._matchers[stub_number] = build_matchers(stub)
+        return matchers
+
+    def predicate(self, stub_number):
+        predicate = self._predicates[stub_number]
+        if predicate is None:
+            predicate = self._predicates[stub_number] = build_predicate(
+                self.matchers(stub_number))
+        return predicate
+
+    def compile(self):
+        for stub_number in range(len(self.payloads)):
+            try:
+                self.predicate(stub_number)
+            except Exception, e:
+                # leave it to get/response to report the error for this stub
+                log.warn('unable to compile matchers for stub ({0}) in {1}: '
+                         '{2}'.format(stub_number, self.key, e))
+        dynamic = [needs_matcher_transform(x) for x in self.payloads]
+        self.static = not any(dynamic)
+        self.contains_index = ContainsIndex(self.payloads, dynamic)
+        self.discriminator_index = DiscriminatorIndex(self.payloads, dynamic)
+        self.url_pattern_index = UrlPatternIndex(self.payloads, dynamic)
+        self.fingerprint_index = FingerprintIndex(self.payloads, dynamic,
+                                                  self.contains_index)
+        if self.adaptive_order:
+            self.hit_order = HitOrder(self.payloads, dynamic)
+        return self
+
+    def candidates(self, request):
+        """Return the stub numbers, in session order, worth evaluating for
+        the request. Uncompiled plans return every stub."""
+        if self.contains_index is None:
+            return range(len(self.payloads))
+        allowed = self.discriminator_index.candidates(request)
+        excluded = self.url_pattern_index.excluded(request)
+        if allowed is not None:
+            allowed -= excluded
+            if not allowed:
+                return []
+        result = self.contains_index.candidates(
+            request.request_body_normalised_chunks())
+        if allowed is not None:
+            result = [x for x in result if x in allowed]
+        elif excluded:
+            result = [x for x in result if x not in excluded]
+        return result
+
+    def exact_candidates(self, request):
+        """Return the few stub numbers that decide the match of a request
+        with the body of a stub recorded from a whole request, else None."""
+        if self.fingerprint_index is None:
+            return None
+        return self.fingerprint_index.candidates(request)
+
+
+def unmatched_request_key(plan, request):
+    """Return the key to remember that a request matched no stub in the
+    session or None if the result can't be reused. Only the request decides
+    the result for a static session and the session version changes
+    whenever its stubs do, so there is nothing else to invalidate."""
+    if not plan.key or not plan.static:
+        return None
+    return plan.key + (request.id(), request.headers)
+
+
+def compile_session(session):
+    """Compile all stub matchers for a session and cache the plan."""
+    plan = SessionPlan(session).compile()
+    if plan.key:
+        session_plans.set(plan.key, plan)
+    return plan
+
+
+def get_session_plan(session):
+    key = session_plan_key(session)
+    if not key:
+        # legacy session without a version, compile lazily for this request
+        return SessionPlan(session)
+    plan = session_plans.get(key)
+    if plan is None:
+        plan = compile_session(session)
+    return plan
@@ -4,12 +4,17 @@ import json
 from hamcrest.core.base_matcher import BaseMatcher
 from hamcrest.core.helpers.hasmethod import hasmethod
 from jsonpath_rw import parse
+from lxml import etree
 
 from six.moves.urllib import parse as urlparse
 from stubo.ext import parse_xml
+from stubo.utils import strip_whitespace, literal_dict, contains_normalised
 
 
 class RequestMatcher(BaseMatcher):
+    # relative cost of a match, cheaper matchers are evaluated first
+    cost = 0
+
     def __init__(self, expected, component_name):
         self.expected = expected
         self.component_name = component_name
@@ -41,15 +46,21 @@ def has_path(path):
 
 
 class UrlArgs(RequestMatcher):
+    cost = 1
+
     def __init__(self, expected, exact_match=False):
         super(UrlArgs, self).__init__(expected, 'query')
         self.exact_match = exact_match
+        self.expected_items = tuple(expected.iteritems())
 
     def _matches(self, request):
-        args = urlparse.parse_qs(self._get_value(request))
+        if hasmethod(request, 'request_query_args'):
+            args = request.request_query_args()
+        else:
+            args = urlparse.parse_qs(self._get_value(request))
         if self.exact_match:
             return args == self.expected
-        return all(item in args.items() for item in self.expected.items())
+        return all(k in args and args[k] == v for k, v in self.expected_items)
 
 
 def has_query_args(query_args, exact_match=False):
@@ -61,19 +72,26 @@ def has_exactly_query_args(query_args):
 
 
 class DictMatcher(RequestMatcher):
+    cost = 1
+
     def __init__(self, expected, attr, exact_match=False):
         if not isinstance(expected, dict):
-            expected = dict(eval(expected))
+            expected = literal_dict(expected)
         super(DictMatcher, self).__init__(expected, attr)
         self.exact_match = exact_match
+        self.expected_items = tuple(expected.iteritems())
 
     def _matches(self, request):
-        headers = self._get_value(request)
-        if not isinstance(headers, dict):
-            headers = dict(eval(headers))
+        if self.component_name == 'headers' and hasmethod(request,
+                                                          'request_headers'):
+            headers = request.request_headers()
+        else:
+            headers = self._get_value(request)
+            if not isinstance(headers, dict):
+                headers = literal_dict(headers)
         if self.exact_match:
             return headers == self.expected
-        return all(headers.get(k) == v for k, v in self.expected.items())
+        return all(headers.get(k) == v for k, v in self.expected_items)
 
 
 def has_headers(query_args, exact_match=False):
@@ -85,10 +103,18 @@ def has_exactly_headers(query_args):
 
 
 class BodyContains(RequestMatcher):
+    cost = 2
+
     def __init__(self, expected):
         super(BodyContains, self).__init__(expected, "body_unicode")
+        self.normalised = None
+        if isinstance(expected, basestring):
+            self.normalised = strip_whitespace(expected)
 
     def _matches(self, request):
+        if self.normalised is not None and hasmethod(request,
+                                                     'request_body_contains'):
+            return request.request_body_contains(self.normalised)
         request_body = self._get_value(request)
         if not isinstance(request_body, basestring) and not hasmethod(request_body, 'find'):
             return False
@@ -99,9 +125,7 @@ class BodyContains(RequestMatcher):
         """x in y?
         x and y should both be unicode
         """
-        x = u''.join(x.split()).strip()
-        y = u''.join(y.split()).strip()
-        return y.find(x) >= 0
+        return contains_normalised(y, strip_whitespace(x))
 
     @staticmethod
     def relationship():
@@ -168,20 +192,25 @@ def has_url_pattern(regex):
 
 class BodyXPath(RequestMatcher):
     """XPath matcher for request body"""
+    cost = 3
 
     def __init__(self, xpath, namespaces=None):
         super(BodyXPath, self).__init__(xpath, "body_unicode")
         self.namespaces = namespaces or {}
+        self.xpath = etree.XPath(xpath, namespaces=self.namespaces)
+
+    def _parse(self, request):
+        if hasmethod(request, 'request_body_xml'):
+            return request.request_body_xml()
+        return parse_xml(self._get_value(request))
 
     def _matches(self, request):
-        xml = self._get_value(request)
         try:
-            doc = parse_xml(xml)
-        except Exception, err:
-            self.error = err
+            doc = self._parse(request)
+        except Exception:
             return False
 
-        found = doc.xpath(self.expected, namespaces=self.namespaces)
+        found = self.xpath(doc)
         return True if found else False
 
     def describe_to(self, description):
@@ -189,8 +218,10 @@ class BodyXPath(RequestMatcher):
 
     def describe_mismatch(self, actual, description):
         description.append_text(u" body does not match xpath: '{}'".format(self.expected))
-        if hasattr(self, 'error'):
-            description.append_text(u" error: {0}".format(self.error))
+        try:
+            self._parse(actual)
+        except Exception, err:
+            description.append_text(u" error: {0}".format(err))
 
 
 def body_xpath(xpath, namespaces=None):
@@ -214,18 +245,23 @@ def body_xpath(xpath, namespaces=None):
 
 class BodyJSONPath(RequestMatcher):
     """JSON Path matcher for request body"""
+    cost = 3
 
     def __init__(self, expr):
         super(BodyJSONPath, self).__init__(expr, "body_unicode")
         self.jsonpath_expr = parse(expr)
 
+    def _parse(self, request):
+        if hasmethod(request, 'request_body_json'):
+            return request.request_body_json()
+        return json.loads(self._get_value(request))
+
     def _matches(self, request):
         try:
-            payload = json.loads(self._get_value(request))
+            payload = self._parse(request)
             found = self.jsonpath_expr.find(payload)
             return True if found else False
-        except Exception, err:
-            self.error = err
+        except Exception:
             return False
 
     def describe_to(self, description):
@@ -233,8 +269,10 @@ class BodyJSONPath(RequestMatcher):
 
     def describe_mismatch(self, actual, description):
         description.append_text(u" body does not match json path: '{}'".format(self.expected))
-        if hasattr(self, 'error'):
-            description.append_text(u" error: {0}".format(self.error))
+        try:
+            self.jsonpath_expr.find(self._parse(actual))
+        except Exception, err:
+            description.append_text(u" error: {0}".format(err))
 
 
 def body_jsonpath(expr):
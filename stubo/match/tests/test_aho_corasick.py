@@ -0,0 +1,42 @@
+#-*- coding: utf-8 -*-
+import unittest
+
+
+class TestAutomaton(unittest.TestCase):
+
+    def _make(self, *patterns):
+        from stubo.match.aho_corasick import Automaton
+        automaton = Automaton()
+        for i, pattern in enumerate(patterns):
+            automaton.add(pattern, i)
+        return automaton.build()
+
+    def test_overlapping(self):
+        automaton = self._make(u'he', u'she', u'his', u'hers')
+        self.assertEqual(automaton.search(u'ushers'), set([0, 1, 3]))
+
+    def test_no_match(self):
+        automaton = self._make(u'abc')
+        self.assertEqual(automaton.search(u'abxabd'), set())
+
+    def test_suffix_via_failure_link(self):
+        automaton = self._make(u'abcd', u'bc')
+        self.assertEqual(automaton.search(u'xabcx'), set([1]))
+
+    def test_unicode(self):
+        automaton = self._make(u'caf\xe9', u'€')
+        self.assertEqual(automaton.search(u'un caf\xe9 pour 2€'),
+                         set([0, 1]))
+
+    def test_same_pattern_many_values(self):
+        from stubo.match.aho_corasick import Automaton
+        automaton = Automaton()
+        automaton.add(u'abc', 1)
+        automaton.add(u'abc', 2)
+        automaton.build()
+        self.assertEqual(automaton.search(u'abc'), set([1, 2]))
+
+    def test_empty_pattern(self):
+        from stubo.match.aho_corasick import Automaton
+        with self.assertRaises(ValueError):
+            Automaton().add(u'', 1)
@@ -0,0 +1,89 @@
+import unittest
+from stubo.testing import DummyModel
+
+
+class TestHitOrder(unittest.TestCase):
+
+    def _stub(self, priority=None, **request):
+        stub = dict(request=request, response=dict(status=200, ids=[1]))
+        if priority is not None:
+            stub['priority'] = priority
+        return stub
+
+    def _make(self, payloads, interval=3, dynamic=None):
+        from stubo.match.hit_order import HitOrder
+        return HitOrder(payloads, dynamic or [False] * len(payloads),
+                        interval=interval)
+
+    def test_disjoint(self):
+        from stubo.match.hit_order import disjoint, discriminators
+        get_a = discriminators(self._stub(method='GET', urlPath='/a'))
+        get_b = discriminators(self._stub(method='GET', urlPath='/b'))
+        get = discriminators(self._stub(method='GET'))
+        self.assertTrue(disjoint(get_a, get_b))
+        self.assertFalse(disjoint(get_a, get))
+        q1 = discriminators(self._stub(queryArgs=dict(x=['1'], y=['2'])))
+        q2 = discriminators(self._stub(queryArgs=dict(x=['2'])))
+        self.assertTrue(disjoint(q1, q2))
+        self.assertFalse(disjoint(q1, {}))
+
+    def test_hot_stub_moves_forward(self):
+        order = self._make([self._stub(urlPath='/a'),
+                            self._stub(urlPath='/b'),
+                            self._stub(urlPath='/c')])
+        for _ in range(3):
+            order.record(2, 3)
+        self.assertEqual(order.order([0, 1, 2]), [2, 0, 1])
+        self.assertEqual(order.stats(), dict(reorders=1, matches=3,
+                                             average_scan_depth=3.0,
+                                             recent_average_scan_depth=0))
+
+    def test_overlapping_stubs_keep_order(self):
+        order = self._make([self._stub(urlPath='/a'),
+                            self._stub(),
+                            self._stub(urlPath='/c')])
+        for _ in range(3):
+            order.record(2, 3)
+        self.assertEqual(order.order([0, 1, 2]), [0, 1, 2])
+
+    def test_priority_and_dynamic_stubs_keep_order(self):
+        payloads = [self._stub(priority=1, urlPath='/a'),
+                    self._stub(priority=2, urlPath='/b'),
+                    self._stub(priority=2, urlPath='/c'),
+                    self._stub(priority=2, urlPath='/d')]
+        order = self._make(payloads, dynamic=[False, False, True, False])
+        for _ in range(3):
+            order.record(3, 4)
+        self.assertEqual(order.order([0, 1, 2, 3]), [0, 1, 2, 3])
+        order = self._make(payloads)
+        for _ in range(3):
+            order.record(3, 4)
+        self.assertEqual(order.order([0, 1, 2, 3]), [0, 3, 1, 2])
+
+    def test_match_with_adaptive_order(self):
+        from stubo.match import match
+        from stubo.match.plan import session_plans, get_session_plan
+        from stubo.model.request import StuboRequest
+        from stubo.utils.track import TrackTrace
+        from stubo.ext.transformer import StuboDefaultHooks
+        session_plans.clear()
+        session = {
+            "session": "first_2",
+            "scenario": "localhost:first",
+            "version": "1",
+            "adaptive_order": True,
+            'stubs': [self._stub(method='GET', urlPath='/a'),
+                      self._stub(method='GET', urlPath='/b')]
+        }
+        request = StuboRequest(DummyModel(body=u'', headers={
+            'Stubo-Request-Method': 'GET',
+            'Stubo-Request-Path': '/b'}))
+        for _ in range(1001):
+            result = match(request, session,
+                           TrackTrace(DummyModel(tracking_level='normal'),
+                                      'matcher'),
+                           None, {}, StuboDefaultHooks())
+            self.assertEqual(result[1], 1)
+        stats = get_session_plan(session).hit_order.stats()
+        self.assertEqual(stats['reorders'], 1)
+        self.assertEqual(stats['matches'], 1001)
@@ -117,6 +117,24 @@ class Test_body_contains_matching(unittest.TestCase):
         with self.assertRaises(HTTPServerError): 
             self._get_best_match("", session)           
 
+    def test_transformed_stub_does_not_change_session(self):
+        from stubo.utils.track import TrackTrace
+        session = {
+            "session": "first_2",
+            "scenario": "localhost:first",
+            'status' : 'playback',
+            "system_date": "2013-09-05",
+            'stubs' : [make_cache_stub(["get {{1+1}} stubs"], [1])]
+        }
+        track = DummyModel(tracking_level='full')
+        trace = TrackTrace(track, 'matcher')
+        results = self._get_best_match("get 2 stubs", session, trace=trace)
+        self.assertTrue(results[0])
+        self.assertEqual(results[2].contains_matchers(), [u'get 2 stubs'])
+        self.assertEqual(session['stubs'][0]['request']['bodyPatterns'],
+                         {'contains': ["get {{1+1}} stubs"]})
+        self.assertTrue('stub (0) was transformed' in str(track.trace))
+
 class TestMatcherWithModule(unittest.TestCase):
     
     def setUp(self):
@@ -541,4 +559,445 @@ class TestStubMatcher(unittest.TestCase):
         stub = self._make_stub(payload)
         self.assertFalse(matcher.match(request, stub)) 
         self.assertEqual(matcher.trace.trace[0][1],
-          ('warn', u" body that matches json path: 'data.x'  body does not match json path: 'data.x'", None))                                                                  
\ No newline at end of file
+          ('warn', u" body that matches json path: 'data.x'  body does not match json path: 'data.x'", None))                                                                  
+
+class PlanTestCase(unittest.TestCase):
+    """Matches requests against a session made of the stubs given."""
+
+    def setUp(self):
+        from stubo.match.plan import session_plans, unmatched_requests
+        session_plans.clear()
+        unmatched_requests.clear()
+
+    def _session(self, stubs, version='1'):
+        session = {
+            "session": "first_2",
+            "scenario": "localhost:first",
+            'stubs': stubs
+        }
+        if version:
+            session['version'] = version
+        return session
+
+    def _request(self, body=u'', **headers):
+        from stubo.model.request import StuboRequest
+        return StuboRequest(DummyModel(body=body, headers=headers))
+
+    def _match(self, stubs, request, hooks=None, version='1', track=None):
+        from stubo.match import match
+        from stubo.utils.track import TrackTrace
+        from stubo.ext.transformer import StuboDefaultHooks
+        track = track or DummyModel(tracking_level='normal')
+        return match(request, self._session(stubs, version),
+                     TrackTrace(track, 'matcher'), None, {},
+                     hooks or StuboDefaultHooks())
+
+    def _get_candidates(self, stubs, body=u'', **headers):
+        from stubo.match.plan import compile_session
+        return compile_session(self._session(stubs)).candidates(
+            self._request(body, **headers))
+
+    def _stub(self, **request):
+        return dict(request=request, response=dict(status=200, ids=[1]))
+
+
+class TestSessionPlan(PlanTestCase):
+
+    def _make_session(self, version=None):
+        return self._session([make_cache_stub(["get my stub"], [1]),
+                              make_cache_stub(["one two three"], [2])],
+                             version)
+
+    def test_plan_cached_by_version(self):
+        from stubo.match.plan import get_session_plan
+        plan = get_session_plan(self._make_session('1'))
+        self.assertTrue(plan is get_session_plan(self._make_session('1')))
+        self.assertFalse(plan is get_session_plan(self._make_session('2')))
+
+    def test_unversioned_plan_not_cached(self):
+        from stubo.match.plan import get_session_plan, session_plans
+        plan = get_session_plan(self._make_session())
+        self.assertTrue(plan.key is None)
+        self.assertEqual(len(session_plans), 0)
+
+    def test_matchers_compiled_once(self):
+        from stubo.match.plan import compile_session
+        plan = compile_session(self._make_session('1'))
+        matchers = plan.matchers(1)
+        self.assertEqual(len(matchers), 2)
+        self.assertTrue(matchers is plan.matchers(1))
+
+    def test_match_uses_plan(self):
+        from stubo.match.plan import compile_session
+        session = self._make_session('1')
+        compile_session(session)
+        with mock.patch('stubo.match.build_matchers') as build:
+            result = self._match(session['stubs'],
+                                 self._request('one two three'))
+            self.assertFalse(build.called)
+        self.assertTrue(result[0])
+        self.assertEqual(result[1], 1)
+
+
+class TestContainsIndex(PlanTestCase):
+
+    def test_candidates(self):
+        stubs = [make_cache_stub(["get my stub"], [1]),
+                 make_cache_stub(["first matcher", "second matcher"], [2]),
+                 make_cache_stub(["one two three"], [3])]
+        self.assertEqual(self._get_candidates(stubs, 'get my   stub'), [0])
+        self.assertEqual(self._get_candidates(stubs, 'first matcher'), [])
+        self.assertEqual(self._get_candidates(stubs,
+            'one two three, first matcher and second matcher'), [1, 2])
+
+    def test_long_matcher(self):
+        text = ' '.join(str(x) for x in range(200))
+        stubs = [make_cache_stub([text], [1]),
+                 make_cache_stub(["1 2 3"], [2])]
+        self.assertEqual(self._get_candidates(stubs, 'xx' + text + 'xx'),
+                         [0, 1])
+        self.assertEqual(self._get_candidates(stubs, text[:-10]), [1])
+
+    def test_dynamic_stubs_always_candidates(self):
+        stubs = [make_cache_stub(["{{1+1}}"], [1]),
+                 make_cache_stub(["get my stub"], [2], module=dict(name='x')),
+                 make_cache_stub([], [3]),
+                 make_cache_stub(["get my stub"], [4])]
+        self.assertEqual(self._get_candidates(stubs, 'nothing'), [0, 1, 2])
+
+    def test_matcher_not_text(self):
+        stubs = [make_cache_stub([123], [1]),
+                 make_cache_stub([None, "get my stub"], [2]),
+                 make_cache_stub(["get my stub"], [3])]
+        self.assertEqual(self._get_candidates(stubs, 'nothing'), [0, 1])
+        self.assertEqual(self._get_candidates(stubs, 'get my stub'),
+                         [0, 1, 2])
+
+    def test_match_with_custom_hooks_checks_all_stubs(self):
+        from stubo.match.plan import compile_session
+        from stubo.ext.transformer import StuboDefaultHooks
+
+        class Hooks(StuboDefaultHooks):
+            def transforms_static_stubs(self):
+                return True
+
+        stubs = [make_cache_stub(["get my stub"], [1])]
+        compile_session(self._session(stubs))
+        track = DummyModel(tracking_level='full')
+        self._match(stubs, self._request('nothing'), hooks=Hooks(),
+                    track=track)
+        self.assertEqual(track.trace['matcher'][1][1][1],
+                         u'matching against 1 of 1 stubs')
+
+
+class TestDiscriminatorIndex(PlanTestCase):
+
+    def test_method_and_path(self):
+        stubs = [self._stub(method='GET', urlPath='/a'),
+                 self._stub(method='GET', urlPath='/b'),
+                 self._stub(method='POST', urlPath='/a'),
+                 self._stub(method='GET'),
+                 self._stub(urlPath='/a'),
+                 self._stub(method='GET', urlPattern='/a.*')]
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'GET',
+            'Stubo-Request-Path': '/a'}), [0, 3, 4, 5])
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'POST',
+            'Stubo-Request-Path': '/a'}), [2, 4])
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'PUT',
+            'Stubo-Request-Path': '/c'}), [])
+
+    def test_query_args(self):
+        stubs = [self._stub(method='GET', queryArgs=dict(foo=['bar'])),
+                 self._stub(method='GET', queryArgs=dict(foo=['bar'],
+                                                         x=['1'])),
+                 self._stub(method='GET')]
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'GET',
+            'Stubo-Request-Query': 'foo=baz'}), [0, 2])
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'GET',
+            'Stubo-Request-Query': 'foo=bar&x=1'}), [0, 1, 2])
+
+    def test_negated_and_dynamic_stubs_are_wildcards(self):
+        stubs = [self._stub(method='GET', urlPath='/a'),
+                 self._stub(**{'!urlPath': '/a'}),
+                 dict(self._stub(method='GET', urlPath='/a'),
+                      module=dict(name='x'))]
+        self.assertEqual(self._get_candidates(stubs, **{
+            'Stubo-Request-Method': 'POST',
+            'Stubo-Request-Path': '/b'}), [1, 2])
+
+
+class TestTransformBypass(PlanTestCase):
+
+    def _classify(self, stub):
+        from stubo.match.plan import classify_stub
+        stub['response']['transform'] = classify_stub(stub)
+        return stub
+
+    def test_classify(self):
+        from stubo.match.plan import classify_stub
+        self.assertEqual(classify_stub(make_stub(["get my stub"], [1])),
+                         dict(matcher=False, response=False))
+        self.assertEqual(classify_stub(make_stub(["{% if 1 %}x{% end %}"], [1])),
+                         dict(matcher=True, response=False))
+        stub = make_stub(["get my stub"], [1])
+        stub['response']['body'] = ['a', 'b {{1}}']
+        self.assertEqual(classify_stub(stub),
+                         dict(matcher=False, response=True))
+        self.assertEqual(classify_stub(make_stub(["get my stub"], [1],
+                                                 module=dict(name='x'))),
+                         dict(matcher=True, response=True))
+
+    def test_static_stub_skips_transform(self):
+        stubs = [self._classify(make_cache_stub(["get my stub"], [1]))]
+        with mock.patch('stubo.match.transform') as transform:
+            result = self._match(stubs, self._request('get my stub'))
+            self.assertFalse(transform.called)
+        self.assertTrue(result[0])
+
+    def test_unclassified_stub_is_transformed(self):
+        stubs = [make_cache_stub(["get my stub"], [1])]
+        with mock.patch('stubo.match.transform') as transform:
+            transform.side_effect = lambda stub, request, **kwargs: (stub,
+                                                                     request)
+            result = self._match(stubs, self._request('get my stub'))
+            self.assertTrue(transform.called)
+        self.assertTrue(result[0])
+
+    def test_template_stub_is_transformed(self):
+        stubs = [self._classify(make_cache_stub(["get {{1+1}} stubs"], [1]))]
+        result = self._match(stubs, self._request('get 2 stubs'))
+        self.assertTrue(result[0])
+
+    def test_custom_hooks_do_not_change_session(self):
+        from stubo.ext.hooks import Hooks
+
+        class InPlaceTransformer(object):
+            def __init__(self, stub):
+                self.stub = stub
+
+            def transform(self, request, **kwargs):
+                self.stub.payload['response']['ids'].append(2)
+                return self.stub, request
+
+        class InPlaceHooks(Hooks):
+            def make_transformer(self, stub):
+                return InPlaceTransformer(stub)
+
+        stubs = [self._classify(make_cache_stub(["get my stub"], [1]))]
+        result = self._match(stubs, self._request('get my stub'),
+                             hooks=InPlaceHooks())
+        self.assertTrue(result[0])
+        self.assertEqual(result[2].payload['response']['ids'], [1, 2])
+        self.assertEqual(stubs[0]['response']['ids'], [1])
+
+
+    def test_default_hooks_subclass_transforms_static_stub(self):
+        from stubo.ext.transformer import StuboDefaultHooks, Transformer
+
+        class GlobalExitHooks(StuboDefaultHooks):
+            def make_transformer(self, stub):
+                return Transformer(stub)
+
+        self.assertFalse(StuboDefaultHooks().transforms_static_stubs())
+        self.assertTrue(GlobalExitHooks().transforms_static_stubs())
+        stubs = [self._classify(make_cache_stub(["get my stub"], [1]))]
+        with mock.patch('stubo.match.transform') as transform:
+            transform.side_effect = lambda stub, request, **kwargs: (stub,
+                                                                     request)
+            result = self._match(stubs, self._request('get my stub'),
+                                 hooks=GlobalExitHooks())
+            self.assertTrue(transform.called)
+        self.assertTrue(result[0])
+
+
+class TestUrlPatternIndex(PlanTestCase):
+
+    def _get_path_candidates(self, stubs, path):
+        return self._get_candidates(stubs, **{'Stubo-Request-Path': path})
+
+    def test_patterns(self):
+        stubs = [self._stub(urlPattern='/thing/[0-9]+'),
+                 self._stub(urlPattern='^/other'),
+                 self._stub(urlPattern='(a)\\1'),
+                 self._stub(urlPattern='(?i)/THING'),
+                 self._stub(method='POST')]
+        self.assertEqual(self._get_path_candidates(stubs, '/thing/1'),
+                         [0, 3, 4])
+        self.assertEqual(self._get_path_candidates(stubs, '/other/thing/1'),
+                         [0, 1, 3, 4])
+        self.assertEqual(self._get_path_candidates(stubs, '/aa'), [2, 4])
+
+    def test_many_patterns(self):
+        stubs = [self._stub(urlPattern='/thing/{0}$'.format(x))
+                 for x in range(250)]
+        self.assertEqual(self._get_path_candidates(stubs, '/thing/7'), [7])
+        self.assertEqual(self._get_path_candidates(stubs, '/thing/201'),
+                         [201])
+        self.assertEqual(self._get_path_candidates(stubs, '/nothing'), [])
+
+    def test_same_as_matcher(self):
+        from stubo.match.request_matcher import has_url_pattern
+        patterns = ['/a.*b', 'b$', '^/a', 'x?', '/[ab]+/c', '']
+        stubs = [self._stub(urlPattern=x) for x in patterns]
+        for path in ['/ab', '/a/c', '/b/b/c', '/c']:
+            request = self._request(**{'Stubo-Request-Path': path})
+            expected = [i for i, x in enumerate(patterns)
+                        if has_url_pattern(x).matches(request)]
+            self.assertEqual(self._get_path_candidates(stubs, path), expected)
+
+
+class TestUnmatchedRequests(PlanTestCase):
+
+    def test_unmatched_request_remembered(self):
+        from stubo.match.plan import unmatched_requests
+        stubs = [make_cache_stub(["get my stub"], [1])]
+        self.assertFalse(self._match(stubs, self._request('nothing'))[0])
+        with mock.patch('stubo.match.StubMatcher') as matcher:
+            self.assertFalse(self._match(stubs, self._request('nothing'))[0])
+            self.assertFalse(matcher.called)
+        self.assertEqual(unmatched_requests.stats()['hits'], 1)
+        self.assertTrue(self._match(stubs, self._request('get my stub'))[0])
+
+    def test_new_session_version(self):
+        request = self._request('get my stub please')
+        stubs = [make_cache_stub(["get your stub"], [1])]
+        self.assertFalse(self._match(stubs, request, version='1')[0])
+        stubs = [make_cache_stub(["get your stub"], [1]),
+                 make_cache_stub(["get my stub"], [2])]
+        self.assertTrue(self._match(stubs, request, version='2')[0])
+
+    def test_dynamic_session_not_remembered(self):
+        from stubo.match.plan import unmatched_requests
+        stubs = [make_cache_stub(["get {{1+1}} stubs"], [1])]
+        self.assertFalse(self._match(stubs, self._request('nothing'))[0])
+        self.assertEqual(len(unmatched_requests), 0)
+
+
+class TestPredicate(PlanTestCase):
+
+    def _check(self, payload, request):
+        from hamcrest import all_of
+        from stubo.match.plan import build_matchers, build_predicate
+        from stubo.model.stub import Stub
+        matchers = build_matchers(Stub(payload, 'test'))
+        expected = all_of(*matchers).matches(request)
+        self.assertEqual(build_predicate(matchers)(request), expected)
+        return expected
+
+    def test_same_as_hamcrest(self):
+        payloads = [
+            dict(request=dict(method='GET', urlPath='/get/me',
+                              queryArgs=dict(foo=['bar']))),
+            dict(request={'method': 'POST', '!urlPath': '/get/me',
+                          'bodyPatterns': {'contains': ['hello'],
+                                           '!contains': ['bye']}}),
+            dict(request={'urlPattern': '/get/.*', '!method': 'GET'}),
+            dict(request={'bodyPatterns': {'xpath': ['/a/b'],
+                                           '!jsonpath': ['x']}}),
+            dict(request={'headers': {'a': 'b'}, '!queryArgs': {'x': ['1']}}),
+        ]
+        requests = [
+            self._request(**{'Stubo-Request-Method': 'GET',
+                             'Stubo-Request-Path': '/get/me',
+                             'Stubo-Request-Query': 'foo=bar'}),
+            self._request(u'hello', **{'Stubo-Request-Path': '/get/x'}),
+            self._request(u'hello bye'),
+            self._request(u'<a><b/></a>'),
+            self._request(**{'Stubo-Request-Headers': "{'a': 'b'}",
+                             'Stubo-Request-Query': 'x=2'}),
+        ]
+        matched = [self._check(x, y) for x in payloads for y in requests]
+        self.assertTrue(any(matched))
+        self.assertFalse(all(matched))
+
+    def test_cheapest_first(self):
+        from stubo.match.plan import build_predicate
+        from stubo.match.request_matcher import body_xpath, has_method
+        xpath = body_xpath('/a')
+        with mock.patch.object(xpath, '_matches') as xpath_matches:
+            predicate = build_predicate([xpath, has_method('GET')])
+            self.assertFalse(predicate(self._request(u'<a/>')))
+            self.assertFalse(xpath_matches.called)
+
+
+class TestFingerprintIndex(PlanTestCase):
+
+    def _make_plan(self, stubs):
+        from stubo.match.plan import SessionPlan
+        return SessionPlan(self._session(stubs, version=None)).compile()
+
+    def _make_request(self, body, method='POST'):
+        return self._request(body, **{'Stubo-Request-Method': method})
+
+    def test_recorded_body(self):
+        stubs = [make_cache_stub(["<b>%d</b>" % x], [x]) for x in range(50)]
+        plan = self._make_plan(stubs)
+        request = self._make_request(u' <b>42</b>\n')
+        self.assertEqual(plan.exact_candidates(request), [42])
+        self.assertEqual(self._match(stubs, request)[1], 42)
+
+    def test_large_recorded_body(self):
+        from stubo.model.request import STREAM_BODY_SIZE
+        body = u'\n'.join(u'<item id="{0}"> value {0} </item>'.format(x)
+                          for x in range(STREAM_BODY_SIZE / 20))
+        self.assertTrue(len(body) >= STREAM_BODY_SIZE)
+        stubs = [make_cache_stub(["<b>%d</b>" % x], [x]) for x in range(5)]
+        stubs.append(make_cache_stub([body], [5]))
+        request = self._make_request(body)
+        self.assertEqual(self._make_plan(stubs).exact_candidates(request), [5])
+        self.assertEqual(self._match(stubs, request)[1], 5)
+
+    def test_no_recorded_body(self):
+        stubs = [make_cache_stub(["<b>%d</b>" % x], [x]) for x in range(5)]
+        plan = self._make_plan(stubs)
+        request = self._make_request(u'<a><b>3</b></a>')
+        self.assertTrue(plan.exact_candidates(request) is None)
+        self.assertEqual(self._match(stubs, request)[1], 3)
+
+    def test_earlier_stub_wins(self):
+        stubs = [make_cache_stub(["<b>1</b>"], [0]),
+                 make_cache_stub(["<b>"], [1]),
+                 make_cache_stub(["<c>"], [2]),
+                 make_cache_stub(["<b>2</b>"], [3])]
+        plan = self._make_plan(stubs)
+        request = self._make_request(u'<b>2</b>')
+        self.assertEqual(plan.exact_candidates(request), [1, 3])
+        self.assertEqual(self._match(stubs, request)[1], 1)
+
+    def test_first_recorded_stub_wins(self):
+        stubs = [make_cache_stub(["<b>1</b>"], [0]),
+                 make_cache_stub(["<b> 1 </b>"], [1])]
+        plan = self._make_plan(stubs)
+        self.assertEqual(plan.exact_candidates(self._make_request(u'<b>1</b>')),
+                         [0])
+
+    def test_method(self):
+        stubs = [make_cache_stub(["<b>1</b>"], [0]),
+                 make_cache_stub(["<b>1</b>"], [1])]
+        stubs[0]['request']['method'] = 'GET'
+        stubs[1]['request']['method'] = 'POST'
+        plan = self._make_plan(stubs)
+        self.assertEqual(plan.exact_candidates(self._make_request(u'<b>1</b>')),
+                         [1])
+        self.assertEqual(plan.exact_candidates(self._make_request(
+            u'<b>1</b>', method='GET')), [0])
+
+    def test_other_matchers_not_indexed(self):
+        stubs = [make_cache_stub(["<b>1</b>"], [0])]
+        stubs[0]['request']['urlPath'] = '/get/me'
+        plan = self._make_plan(stubs)
+        self.assertTrue(plan.exact_candidates(
+            self._make_request(u'<b>1</b>')) is None)
+
+    def test_dynamic_stubs_evaluated_first(self):
+        stubs = [make_cache_stub(["<b>{{1+1}}</b>"], [0]),
+                 make_cache_stub(["<b>2</b>"], [1])]
+        plan = self._make_plan(stubs)
+        request = self._make_request(u'<b>2</b>')
+        self.assertEqual(plan.exact_candidates(request), [0, 1])
+        self.assertEqual(self._match(stubs, request)[1], 0)
@@ -0,0 +1,88 @@
+import unittest
+from stubo.testing import make_cache_stub, DummyModel
+
+
+class TestParallelMatcher(unittest.TestCase):
+
+    def setUp(self):
+        from stubo.match.plan import session_plans
+        session_plans.clear()
+
+    def _make_session(self, stubs):
+        return {
+            "session": "first_2",
+            "scenario": "localhost:first",
+            "version": "1",
+            'stubs': stubs
+        }
+
+    def _make_request(self, body):
+        from stubo.model.request import StuboRequest
+        return StuboRequest(DummyModel(body=body, headers={}))
+
+    def _match(self, session, request_text, parallel, tracking_level='normal'):
+        from stubo.match import match
+        from stubo.utils.track import TrackTrace
+        from stubo.ext.transformer import StuboDefaultHooks
+        return match(self._make_request(request_text), session,
+                     TrackTrace(DummyModel(tracking_level=tracking_level),
+                                'matcher'),
+                     None, {}, StuboDefaultHooks(), parallel=parallel)
+
+    def _make_parallel(self, executor, threshold=2, chunk_size=2):
+        from stubo.match.parallel import ParallelMatcher
+        return ParallelMatcher(executor, 2, threshold, chunk_size)
+
+    def test_match_chunk(self):
+        from stubo.match.parallel import (
+            match_chunk, compact_stubs, MISSING_PLAN
+        )
+        from stubo.match.plan import SessionPlan
+        session = self._make_session([make_cache_stub(["a"], [1]),
+                                      make_cache_stub(["b"], [2]),
+                                      make_cache_stub(["b"], [3])])
+        key = ('localhost:first', 'first_2', '1')
+        request = self._make_request(u'b')
+        self.assertEqual(match_chunk(key, [1, 2], request), MISSING_PLAN)
+        stubs = compact_stubs(SessionPlan(session))
+        self.assertEqual(stubs[0], {'request': session['stubs'][0]['request']})
+        self.assertEqual(match_chunk(key, [1, 2], request, stubs), 1)
+        self.assertEqual(match_chunk(key, [0], request), None)
+
+    def test_lowest_match_wins(self):
+        from concurrent.futures import ProcessPoolExecutor
+        stubs = [make_cache_stub(["stub {0};".format(x)], [x])
+                 for x in range(10)]
+        stubs.append(make_cache_stub(["stub 7;"], [10]))
+        session = self._make_session(stubs)
+        executor = ProcessPoolExecutor(2)
+        try:
+            parallel = self._make_parallel(executor)
+            result = self._match(session, u'stub 7; stub 8;', parallel)
+            self.assertEqual(result[1], 7)
+            self.assertEqual(result[2].response_ids(), [7])
+            self.assertFalse(self._match(session, u'stub x', parallel)[0])
+        finally:
+            executor.shutdown()
+
+    def test_not_used(self):
+        from concurrent.futures import ThreadPoolExecutor
+        stubs = [make_cache_stub(["stub {0};".format(x)], [x])
+                 for x in range(3)]
+        executor = ThreadPoolExecutor(1)
+        parallel = self._make_parallel(executor, threshold=3)
+        try:
+            from stubo.match.plan import compile_session
+            plan = compile_session(self._make_session(stubs))
+            self.assertTrue(parallel.accepts(plan, [0, 1, 2],
+                                             DummyModel(full_tracking=0)))
+            self.assertFalse(parallel.accepts(plan, [0, 1],
+                                              DummyModel(full_tracking=0)))
+            self.assertFalse(parallel.accepts(plan, [0, 1, 2],
+                                              DummyModel(full_tracking=1)))
+            stubs.append(make_cache_stub(["{{1+1}}"], [4]))
+            plan = compile_session(self._make_session(stubs))
+            self.assertFalse(parallel.accepts(plan, [0, 1, 2, 3],
+                                              DummyModel(full_tracking=0)))
+        finally:
+            executor.shutdown()
@@ -49,6 +49,19 @@ class TestBodyContains(Base):
     def test_has_body_failure(self):
         assert_that(self.get_stubo_request(body='hello my friend'), 
                     is_not(body_contains('enemy')))        
+
+    def test_expected_normalised_once(self):
+        matcher = body_contains(u' my\n friend ')
+        self.assertEqual(matcher.normalised, u'myfriend')
+
+    def test_uses_request_normalised_body(self):
+        import mock
+        request = self.get_stubo_request(body='hello my friend')
+        with mock.patch('stubo.model.request.strip_whitespace',
+                        return_value=u'hellomyfriend') as strip:
+            assert_that(request, body_contains('my friend'))
+            assert_that(request, body_contains('hello'))
+            self.assertEqual(strip.call_count, 1)
         
 class TestPath(Base):
     
@@ -89,6 +102,24 @@ class TestXPath(Base):
         assert_that(self.get_stubo_request(body='<findx><me>hello</me></findx>'),
                     is_not(body_xpath('//find/me')))       
 
+    def test_compiled_with_namespaces(self):
+        matcher = body_xpath('/user:find/me', {'user' : "http://www.my.com/userschema"})
+        self.assertEqual(matcher.xpath.path, '/user:find/me')
+
+    def test_shares_parsed_request(self):
+        import mock
+        request = self.get_stubo_request(body='<find><me>hello</me></find>')
+        with mock.patch('stubo.model.request.parse_xml') as parse:
+            from lxml import etree
+            parse.return_value = etree.fromstring('<find><me>hello</me></find>')
+            assert_that(request, body_xpath('/find/me'))
+            assert_that(request, is_not(body_xpath('/find/you')))
+            self.assertEqual(parse.call_count, 1)
+
+    def test_not_xml(self):
+        assert_that(self.get_stubo_request(body='hello'),
+                    is_not(body_xpath('/find/me')))
+
 class TestJSONPath(Base):
     
     def test_match(self):
@@ -216,4 +247,13 @@ class TestHeaders(Base):
         headers = {}
         assert_that(self.get_stubo_request(**headers), 
                     is_not(has_headers('{"Content-Type" : "text/xml"}')))           
-                            
\ No newline at end of file
+                            
+    def test_headers_not_evaluated(self):
+        headers = {
+            'Stubo-Request-Headers' : '__import__("os").getcwd()'
+        }
+        with self.assertRaises(ValueError):
+            has_headers('{"Content-Type" : "text/xml"}').matches(
+                self.get_stubo_request(**headers))
+        with self.assertRaises(ValueError):
+            has_headers('__import__("os").getcwd()')
@@ -2,7 +2,22 @@
     :copyright: (c) 2015 by OpenCredo.
     :license: GPLv3, see LICENSE for more details.
 """
-from stubo.utils import get_unicode_from_request, compute_hash
+import copy
+import hashlib
+import json
+
+from six.moves.urllib import parse as urlparse
+
+from stubo.ext import parse_xml
+from stubo.utils import (
+    get_unicode_from_request, compute_hash, strip_whitespace, literal_dict,
+    contains_normalised, normalised_chunks
+)
+
+# bodies of this size or more are searched in place by the contains
+# matchers, and indexed a chunk at a time, rather than keeping a whitespace
+# free copy of the whole body
+STREAM_BODY_SIZE = 256 * 1024
 
 
 class StuboRequest(object):
@@ -22,6 +37,40 @@ class StuboRequest(object):
         self.query = request.headers.get('Stubo-Request-Query', '')
         self.body = request.body
         self.body_unicode = get_unicode_from_request(request)
+        # (source, parsed) pairs for the headers and query
+        self._parsed_headers = self._parsed_query = None
+
+    @property
+    def body_unicode(self):
+        return self._body_unicode
+
+    @body_unicode.setter
+    def body_unicode(self, body):
+        self._body_unicode = body
+        # views derived from the body are computed at most once per body
+        self._body_views = {}
+
+    def request_headers(self):
+        """ Request headers parsed into a dict, shared by all the header
+        matchers evaluated for this request so it must not be modified.
+        """
+        parsed = self._parsed_headers
+        if parsed is None or parsed[0] is not self.headers:
+            headers = self.headers
+            if not isinstance(headers, dict):
+                headers = literal_dict(headers)
+            parsed = self._parsed_headers = (self.headers, headers)
+        return parsed[1]
+
+    def request_query_args(self):
+        """ Request query string parsed into a dict of lists, shared like
+        request_headers.
+        """
+        parsed = self._parsed_query
+        if parsed is None or parsed[0] is not self.query:
+            parsed = self._parsed_query = (self.query,
+                                           urlparse.parse_qs(self.query or ''))
+        return parsed[1]
 
     def id(self):
         return compute_hash(u"".join([self.request_body(), self.path or "",
@@ -41,6 +90,89 @@ class StuboRequest(object):
     def set_request_body_unicode(self, body):
         self.body_unicode = body
 
+    def request_body_normalised(self):
+        """ Request body text with all whitespace removed, shared by all the
+        contains matchers evaluated for this request.
+        """
+        views = self._body_views
+        if 'normalised' not in views:
+            views['normalised'] = strip_whitespace(self.body_unicode)
+        return views['normalised']
+
+    def request_body_contains(self, normalised):
+        """ Return True if the whitespace free text is found in the request
+        body with its whitespace removed.
+        """
+        if len(self.body_unicode) < STREAM_BODY_SIZE:
+            return self.request_body_normalised().find(normalised) >= 0
+        return contains_normalised(self.body_unicode, normalised)
+
+    def request_body_normalised_chunks(self):
+        """ Request body text with all whitespace removed, in chunks for
+        large bodies.
+        """
+        if len(self.body_unicode) < STREAM_BODY_SIZE:
+            return [self.request_body_normalised()]
+        return normalised_chunks(self.body_unicode)
+
+    def request_body_fingerprint(self):
+        """ Hash of the request body with all whitespace removed, equal to
+        compute_hash of the normalised body.
+        """
+        views = self._body_views
+        if 'fingerprint' not in views:
+            digest = hashlib.sha224()
+            for chunk in self.request_body_normalised_chunks():
+                digest.update(chunk.encode('utf-8'))
+            views['fingerprint'] = digest.hexdigest()
+        return views['fingerprint']
+
+    def request_body_xml(self):
+        """ Request body parsed as XML. The tree is shared by all the xpath
+        matchers and transformers that see this request body so it must not
+        be modified. Raises the parse error if the body is not XML.
+        """
+        doc, err = self._body_view('xml', parse_xml)
+        if err is not None:
+            raise err
+        return doc
+
+    def request_body_json(self):
+        """ Request body decoded from JSON, shared like request_body_xml.
+        Raises the decode error if the body is not JSON.
+        """
+        payload, err = self._body_view('json', json.loads)
+        if err is not None:
+            raise err
+        return payload
+
+    def _body_view(self, name, parse):
+        views = self._body_views
+        if name not in views:
+            try:
+                views[name] = parse(self.body_unicode), None
+            except Exception, e:
+                views[name] = None, e
+        return views[name]
+
+    def __copy__(self):
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        return result
+
+    def __deepcopy__(self, memo):
+        # all attributes are immutable apart from the body views which are
+        # shared until the copy is given a new body
+        result = copy.copy(self)
+        memo[id(self)] = result
+        return result
+
+    def __getstate__(self):
+        # parsed views can't be pickled, they are parsed again when needed
+        state = self.__dict__.copy()
+        state['_body_views'] = {}
+        return state
+
     def __eq__(self, other):
         if type(other) is type(self):
             return self.request_body() == other.request_body()
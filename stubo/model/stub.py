@@ -4,6 +4,7 @@
 """
 import logging
 import json
+import copy
 
 from stubo.model.stub_parser import (
     JSONStubParser, LegacyStubParser
@@ -31,9 +32,45 @@ def parse_stub(body, scenario, url_args):
 
 
 class StubData(object):
-    def __init__(self, payload, scenario):
+    """Accessors for a stub payload.
+
+    A ``copy_on_write`` stub shares its payload, e.g. with a cached session,
+    and the parts of the payload it changes are only copied on the first
+    change. Stubs must be changed with the setters for this to hold, so
+    stubs given to user exits and custom hooks are deep copies instead.
+    """
+
+    def __init__(self, payload, scenario, copy_on_write=False):
         self.payload = payload
         self.hostname, _, self.scenario_name = scenario.partition(':')
+        # the parts of a shared payload already copied, None if not shared
+        self._copied = set() if copy_on_write else None
+
+    def copy(self):
+        """Return a copy of this stub, the payload is shared by both stubs
+        until either of them changes it."""
+        self._copied = set()
+        stub = copy.copy(self)
+        stub._copied = set()
+        return stub
+
+    def _writable(self, *path):
+        """Return the dict at path in the payload ready to be changed."""
+        target = self.payload
+        copied = self._copied
+        if copied is None:
+            for key in path:
+                target = target[key]
+            return target
+        if () not in copied:
+            self.payload = target = dict(target)
+            copied.add(())
+        for i, key in enumerate(path):
+            if path[:i + 1] not in copied:
+                target[key] = dict(target[key])
+                copied.add(path[:i + 1])
+            target = target[key]
+        return target
 
     def __eq__(self, other):
         if type(other) is type(self):
@@ -59,7 +96,14 @@ class StubData(object):
         return self.payload['response'].get('headers')
 
     def set_response_body(self, body):
-        self.response()['body'] = body
+        self._writable('response')['body'] = body
+
+    def needs_transform(self, stage):
+        """Return False if the stub was found to be static for the transform
+        stage, 'matcher' or 'response', when the session was loaded. Stubs
+        that have not been classified always need to be transformed."""
+        response = self.payload.get('response') or {}
+        return response.get('transform', {}).get(stage, True)
 
     def response_body(self):
         # Note can be more than one response for stateful requests
@@ -74,16 +118,16 @@ class StubData(object):
         return self.response().get('delayPolicy')
 
     def set_delay_policy(self, policy):
-        self.response()['delayPolicy'] = policy
+        self._writable('response')['delayPolicy'] = policy
 
     def priority(self):
         return self.payload.get('priority')
 
     def set_priority(self, priority):
-        self.payload['priority'] = priority
+        self._writable()['priority'] = priority
 
     def set_args(self, args):
-        self.payload['args'] = args
+        self._writable()['args'] = args
 
     def request(self):
         return self.payload['request']
@@ -101,7 +145,7 @@ class StubData(object):
         return self.payload['request'].get('bodyPatterns', {}).get('contains')
 
     def set_contains_matchers(self, matchers):
-        self.request()['bodyPatterns']['contains'] = matchers
+        self._writable('request', 'bodyPatterns')['contains'] = matchers
 
     def number_of_matchers(self):
         return len(self.contains_matchers() or [])
@@ -110,19 +154,19 @@ class StubData(object):
         return self.payload.get('args', {})
 
     def set_args(self, args):
-        self.payload['args'] = args
+        self._writable()['args'] = args
 
     def recorded(self):
         return self.payload.get('recorded')
 
     def set_recorded(self, recorded):
-        self.payload['recorded'] = recorded
+        self._writable()['recorded'] = recorded
 
     def module(self):
         return self.payload.get('module', {})
 
     def set_module(self, module):
-        self.payload['module'] = module
+        self._writable()['module'] = module
 
     def space_used(self):
         return len(unicode(self.payload))
@@ -183,8 +227,8 @@ class Stub(StubData):
 
 
 class StubCache(StubData):
-    def __init__(self, payload, scenario, session_name):
-        StubData.__init__(self, payload, scenario)
+    def __init__(self, payload, scenario, session_name, copy_on_write=False):
+        StubData.__init__(self, payload, scenario, copy_on_write)
         self.session_name = session_name
         from stubo.cache import Cache
 
@@ -205,6 +249,7 @@ class StubCache(StubData):
     def load_from_cache(self, response_ids, delay_policy_name, recorded,
                         system_date, module_info, request_index_key):
         self.payload = dict(response=dict(ids=response_ids))
+        self._copied = None
         response = self.get_response_from_cache(request_index_key)
         self.payload['response'] = response
         self.set_recorded(recorded)
@@ -0,0 +1,162 @@
+import unittest
+
+
+class TestStuboRequest(unittest.TestCase):
+
+    def _make(self, body=u'', **headers):
+        from stubo.model.request import StuboRequest
+        from stubo.testing import DummyModel
+        return StuboRequest(DummyModel(body=body, headers=headers))
+
+    def test_body_normalised(self):
+        request = self._make(u' get  my\r\n stub ')
+        self.assertEqual(request.request_body_normalised(), u'getmystub')
+
+    def test_body_normalised_computed_once(self):
+        request = self._make(u'get my stub')
+        self.assertTrue(request.request_body_normalised() is
+                        request.request_body_normalised())
+
+    def test_body_change_resets_views(self):
+        request = self._make(u'get my stub')
+        request.request_body_normalised()
+        request.set_request_body_unicode(u'get your stub')
+        self.assertEqual(request.request_body_normalised(), u'getyourstub')
+        request.body_unicode = u'get our stub'
+        self.assertEqual(request.request_body_normalised(), u'getourstub')
+
+    def test_body_xml_parsed_once(self):
+        request = self._make(u'  <x><y>hello</y></x>')
+        doc = request.request_body_xml()
+        self.assertEqual(doc.xpath('/x/y')[0].text, 'hello')
+        self.assertTrue(doc is request.request_body_xml())
+
+    def test_body_xml_error(self):
+        request = self._make(u'not xml')
+        from lxml.etree import XMLSyntaxError
+        with self.assertRaises(XMLSyntaxError):
+            request.request_body_xml()
+        with self.assertRaises(XMLSyntaxError):
+            request.request_body_xml()
+
+    def test_body_json(self):
+        request = self._make(u'{"data": {"message": "ok"}}')
+        self.assertEqual(request.request_body_json(),
+                         {"data": {"message": "ok"}})
+        self.assertTrue(request.request_body_json() is
+                        request.request_body_json())
+        with self.assertRaises(ValueError):
+            self._make(u'<x/>').request_body_json()
+
+    def test_deepcopy_shares_views_until_body_changes(self):
+        import copy
+        request = self._make(u'<x/>')
+        doc = request.request_body_xml()
+        request_copy = copy.deepcopy(request)
+        self.assertTrue(request_copy.request_body_xml() is doc)
+        request_copy.set_request_body_unicode(u'<y/>')
+        self.assertEqual(request_copy.request_body_xml().tag, 'y')
+        self.assertTrue(request.request_body_xml() is doc)
+
+    def test_pickle_drops_views(self):
+        import pickle
+        request = self._make(u'<x/>')
+        request.request_body_xml()
+        request2 = pickle.loads(pickle.dumps(request))
+        self.assertEqual(request2, request)
+        self.assertEqual(request2.request_body_xml().tag, 'x')
+        self.assertTrue(request.request_body_xml() is not
+                        request2.request_body_xml())
+
+    def test_request_headers(self):
+        request = self._make(**{'Stubo-Request-Headers':
+                                "{'Content-Type': 'text/xml'}"})
+        self.assertEqual(request.request_headers(),
+                         {'Content-Type': 'text/xml'})
+        self.assertTrue(request.request_headers() is request.request_headers())
+        self.assertEqual(self._make().request_headers(), {})
+
+    def test_request_query_args(self):
+        request = self._make(**{'Stubo-Request-Query': 'a=1&a=2&b=3'})
+        self.assertEqual(request.request_query_args(),
+                         {'a': ['1', '2'], 'b': ['3']})
+        self.assertTrue(request.request_query_args() is
+                        request.request_query_args())
+        request.query = 'c=4'
+        self.assertEqual(request.request_query_args(), {'c': ['4']})
+
+    def test_body_contains(self):
+        request = self._make(u'<a>\n  <b>get my stub</b>\n</a>')
+        self.assertTrue(request.request_body_contains(u'<b>getmystub</b>'))
+        self.assertFalse(request.request_body_contains(u'<b>getmystub</c>'))
+
+    def test_large_body_searched_in_place(self):
+        import mock
+        from stubo.utils import contains_normalised
+        body = u' '.join(u'<i>{0}</i>'.format(x) for x in range(2000))
+        request = self._make(body)
+        with mock.patch('stubo.model.request.STREAM_BODY_SIZE', 100):
+            self.assertTrue(request.request_body_contains(u'<i>1999</i>'))
+            self.assertTrue(request.request_body_contains(u'<i>5</i><i>6</i>'))
+            self.assertFalse(request.request_body_contains(u'<i>5</i><i>7</i>'))
+            self.assertEqual(u''.join(request.request_body_normalised_chunks()),
+                             u''.join(body.split()))
+            self.assertFalse('normalised' in request._body_views)
+        self.assertTrue(contains_normalised(u'a b  c\nd', u'bcd'))
+        self.assertFalse(contains_normalised(u'a b  c\nd', u'bd'))
+        self.assertTrue(contains_normalised(u'a.b\u00a0*c', u'.b*c'))
+        self.assertTrue(contains_normalised('a b\tc', 'abc'))
+        self.assertTrue(contains_normalised(u'', u''))
+        self.assertFalse(contains_normalised(u'', u'a'))
+
+    def test_long_needle(self):
+        from stubo.utils import contains_normalised, CONTAINS_PREFIX_SIZE
+        text = u' '.join(u'<i>{0}</i>'.format(x) for x in range(200))
+        normalised = u''.join(text.split())
+        needle = normalised[50:400]
+        self.assertTrue(len(needle) > CONTAINS_PREFIX_SIZE)
+        self.assertTrue(contains_normalised(text, needle))
+        self.assertTrue(contains_normalised(text, normalised))
+        self.assertFalse(contains_normalised(text, needle + u'x'))
+        # the prefix occurs before the match and overlapping it
+        text = u'a' * 100 + u' a' * 100 + u'b'
+        self.assertTrue(contains_normalised(text, u'a' * 150 + u'b'))
+        self.assertFalse(contains_normalised(text, u'a' * 150 + u'c'))
+
+    def test_large_body_work_bounded(self):
+        import mock
+        from stubo import utils
+        from stubo.utils import strip_whitespace
+        body = u'\n'.join(u'  <item id="{0}"> value {0} </item>'.format(x)
+                           for x in range(20000))
+        matchers = [u'<itemid="{0}">value{0}</item>'.format(x)
+                    for x in (5, 10000, 19999)]
+        matchers.append(u''.join(body.split())[1000:1300])
+        copied = []
+
+        def counting_strip(text):
+            copied.append(len(text))
+            return strip_whitespace(text)
+
+        utils.contains_patterns.clear()
+        with mock.patch('stubo.model.request.STREAM_BODY_SIZE', 100), \
+                mock.patch('stubo.utils.strip_whitespace', counting_strip):
+            for _ in range(2):
+                request = self._make(body)
+                for matcher in matchers:
+                    self.assertTrue(request.request_body_contains(matcher))
+                self.assertFalse(request.request_body_contains(u'nothere'))
+        # only the text compared beyond the prefix of a matcher is copied,
+        # never the body, and each prefix is compiled once
+        self.assertTrue(sum(copied) < 2 * sum(len(x) for x in matchers))
+        self.assertEqual(len(utils.contains_patterns), len(matchers) + 1)
+
+    def test_body_fingerprint(self):
+        import mock
+        from stubo.utils import compute_hash
+        body = u' '.join(u'<i>{0}</i>'.format(x) for x in range(2000))
+        expected = compute_hash(u''.join(body.split()))
+        self.assertEqual(self._make(body).request_body_fingerprint(), expected)
+        with mock.patch('stubo.model.request.STREAM_BODY_SIZE', 100):
+            self.assertEqual(self._make(body).request_body_fingerprint(),
+                             expected)
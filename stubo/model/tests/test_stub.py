@@ -171,3 +171,56 @@ class TestParse(unittest.TestCase):
         self.assertEquals(stub.request_method(), 'POST')
         self.assertEqual(stub.response_body()[0], 'a response')
         self.assertEqual(stub.response_status(), 200)
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    def _make(self, payload, **kwargs):
+        from stubo.model.stub import Stub, StubData
+
+        stub = Stub(payload, 'localhost:foo')
+        if kwargs.get('copy_on_write'):
+            stub = StubData(payload, 'localhost:foo', copy_on_write=True)
+        return stub
+
+    def _payload(self):
+        from stubo.model.stub import create
+
+        return create('get my stub', 'a response')
+
+    def test_shared_until_changed(self):
+        payload = self._payload()
+        stub = self._make(payload, copy_on_write=True)
+        self.assertTrue(stub.payload is payload)
+        stub.set_response_body('changed')
+        self.assertEqual(stub.response_body(), ['changed'])
+        self.assertEqual(payload['response']['body'], 'a response')
+        # unchanged parts are still shared
+        self.assertTrue(stub.request() is payload['request'])
+
+    def test_change_matchers(self):
+        payload = self._payload()
+        stub = self._make(payload, copy_on_write=True)
+        stub.set_contains_matchers(['new'])
+        stub.set_contains_matchers(['newer'])
+        self.assertEqual(stub.contains_matchers(), ['newer'])
+        self.assertEqual(payload['request']['bodyPatterns']['contains'],
+                         ['get my stub'])
+        self.assertTrue(stub.response() is payload['response'])
+
+    def test_not_shared_changes_in_place(self):
+        payload = self._payload()
+        stub = self._make(payload)
+        stub.set_recorded('2015-01-01')
+        self.assertTrue(stub.payload is payload)
+        self.assertEqual(payload['recorded'], '2015-01-01')
+
+    def test_copy(self):
+        payload = self._payload()
+        stub = self._make(payload)
+        stub2 = stub.copy()
+        self.assertTrue(stub2.payload is stub.payload)
+        stub2.set_priority(3)
+        stub.set_priority(1)
+        self.assertEqual(stub2.priority(), 3)
+        self.assertEqual(stub.priority(), 1)
+        self.assertTrue('priority' not in payload)
@@ -6,12 +6,16 @@ from argparse import ArgumentParser
 import sys
 import logging
 import logging.config
+import time
 from datetime import datetime, timedelta
 
 from pymongo import ASCENDING, DESCENDING
 from pymongo.errors import CollectionInvalid
+from redis.exceptions import ResponseError
 
 from stubo.utils import init_mongo, start_redis, as_date, read_config
+from stubo.cache import Cache, SESSION_KEY_LAYOUTS, codec
+from stubo.cache.queue import Hash, scan_keys
 from stubo.service.api import list_scenarios, get_status, delete_stubs
 from stubo.model.db import default_env, coerce_mongo_param
 from stubo.testing import DummyRequestHandler
@@ -158,3 +162,144 @@ def purge_stubs():
                         log.error('delete stubs error: {0}'.format(response['error']))
                     else:
                         log.info('deleted stubs: {0}'.format(response['data']))
+
+
+def cached_scenarios(master, host='all'):
+    """Yield each host with sessions in the cache and its scenarios."""
+    # the scenarios of each host with sessions are in host:sessions
+    for sessions_key in scan_keys(master, '*:sessions'):
+        hostname = sessions_key.rpartition(':')[0]
+        if host != 'all' and host != hostname:
+            continue
+        yield hostname, set(Hash(master).get_all_raw(sessions_key).values())
+
+
+def migrate_session_keys():
+    parser = ArgumentParser(
+        description="Move the request, response and request index data of "
+                    "sessions to the given session_key_layout. Stop stubo "
+                    "first and restart it with the new layout after."
+    )
+    parser.add_argument('layout', choices=SESSION_KEY_LAYOUTS,
+                        help="the session key layout to migrate to")
+    parser.add_argument('--host', default='all', dest='host',
+                        help="specify the host uri to use (defaults to all)")
+    parser.add_argument('-c', '--config', dest='config',
+                        help='Path to configuration file (defaults to $CWD/etc/dev.ini)',
+                        metavar='FILE')
+
+    args = parser.parse_args()
+    config = args.config or get_default_config()
+    logging.config.fileConfig(config)
+    settings = read_config(config)
+    slave, master = start_redis(settings)
+
+    for hostname, scenarios in cached_scenarios(master, args.host):
+        cache = Cache(hostname)
+        for scenario in scenarios:
+            moved = cache.migrate_session_data(scenario, args.layout)
+            log.info("moved {0} keys of scenario '{1}:{2}' to the '{3}' "
+                     "layout".format(moved, hostname, scenario, args.layout))
+
+
+def recode_cache_values():
+    parser = ArgumentParser(
+        description="Write the cached sessions, requests, responses, delay "
+                    "policies and settings again with the codec given by "
+                    "redis.codec in the config. Stop stubo first."
+    )
+    parser.add_argument('--host', default='all', dest='host',
+                        help="specify the host uri to use (defaults to all)")
+    parser.add_argument('-c', '--config', dest='config',
+                        help='Path to configuration file (defaults to $CWD/etc/dev.ini)',
+                        metavar='FILE')
+
+    args = parser.parse_args()
+    config = args.config or get_default_config()
+    logging.config.fileConfig(config)
+    settings = read_config(config)
+    slave, master = start_redis(settings)
+
+    names = ['stubo_setting']
+    for hostname, scenarios in cached_scenarios(master, args.host):
+        cache = Cache(hostname)
+        names.extend((cache.get_delay_policy_key(),
+                      '{0}:stubo_setting'.format(hostname)))
+        for scenario in scenarios:
+            names.extend(cache.encoded_hash_names(scenario))
+    for name in names:
+        recoded = Hash(master).recode(name)
+        if recoded:
+            log.info("wrote {0} values of '{1}' as {2}".format(
+                recoded, name, codec.codec.name))
+
+
+def benchmark_codecs():
+    parser = ArgumentParser(
+        description="Compare the encode and decode times and redis memory "
+                    "of the cached sessions with each codec."
+    )
+    parser.add_argument('--host', default='all', dest='host',
+                        help="specify the host uri to use (defaults to all)")
+    parser.add_argument('-n', '--number', default=10, type=int, dest='number',
+                        help="times to encode and decode each session "
+                             "(default is 10)")
+    parser.add_argument('-c', '--config', dest='config',
+                        help='Path to configuration file (defaults to $CWD/etc/dev.ini)',
+                        metavar='FILE')
+
+    args = parser.parse_args()
+    config = args.config or get_default_config()
+    logging.config.fileConfig(config)
+    settings = read_config(config)
+    slave, master = start_redis(settings)
+
+    names = [x for x in sorted(codec.codecs)
+             if x != 'msgpack' or codec.msgpack is not None]
+    results = dict((x, dict(encode=0.0, decode=0.0, size=0, memory=0))
+                   for x in names)
+    sessions = 0
+    for hostname, scenarios in cached_scenarios(master, args.host):
+        cache = Cache(hostname)
+        for scenario in scenarios:
+            raw_sessions = Hash(master).get_all_raw(
+                cache.scenario_key_name(scenario))
+            for raw in raw_sessions.itervalues():
+                session = codec.decode(raw)
+                sessions += 1
+                for name in names:
+                    result = results[name]
+                    encoder = codec.codecs[name]
+                    start = time.time()
+                    for i in range(args.number):
+                        data = encoder.encode(session)
+                    result['encode'] += time.time() - start
+                    start = time.time()
+                    for i in range(args.number):
+                        encoder.decode(data)
+                    result['decode'] += time.time() - start
+                    result['size'] += len(data)
+                    result['memory'] += redis_memory_usage(master, data)
+
+    print '{0} sessions, each encoded and decoded {1} times'.format(
+        sessions, args.number)
+    print '{0:<10}{1:>14}{2:>14}{3:>14}{4:>14}'.format(
+        'codec', 'encode ms', 'decode ms', 'bytes', 'redis bytes')
+    for name in names:
+        result = results[name]
+        print '{0:<10}{1:>14.1f}{2:>14.1f}{3:>14}{4:>14}'.format(
+            name, result['encode'] * 1000, result['decode'] * 1000,
+            result['size'], result['memory'])
+
+
+def redis_memory_usage(server, data):
+    """Return the bytes redis uses to store the value, or its length if the
+    server does not support MEMORY USAGE (< 4.0)."""
+    key = 'stubo:benchmark_codecs'
+    server.set(key, data)
+    try:
+        return server.execute_command('MEMORY', 'USAGE', key)
+    except ResponseError:
+        return len(data)
+    finally:
+        server.delete(key)
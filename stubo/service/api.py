@@ -9,6 +9,7 @@ import shutil
 import logging
 import random
 import sys
+import time
 import copy
 from urlparse import urlparse
 from StringIO import StringIO
@@ -33,14 +34,17 @@ from stubo.exceptions import (
 )
 from stubo import version
 from stubo.cache import (
-    Cache, add_request, get_redis_server, get_keys
+    Cache, add_request, get_redis_server, get_keys, session_cache
 )
 from stubo.utils import (
     asbool, make_temp_dir, get_export_links, get_hostname,
-    pretty_format_python, as_date
+    pretty_format_python, as_date, redis_pool_stats, exception_text
 )
 from stubo.utils.track import TrackTrace
 from stubo.match import match
+from stubo.match.plan import (
+    session_plan_key, session_plans, unmatched_requests
+)
 from stubo.model.request import StuboRequest
 from stubo.ext import today_str
 from stubo.ext.transformer import transform
@@ -257,8 +261,8 @@ def list_module(handler, names):
     module = Module(get_hostname(handler.request))
     info = {}
     if not names:
-        names = [x.rpartition(':')[-1] for x in get_keys(
-            '{0}:modules:*'.format(module.host()))]
+        names = (x.rpartition(':')[-1] for x in get_keys(
+            '{0}:modules:*'.format(module.host())))
     for name in names:
         loaded_sys_versions = [x for x in sys.modules.keys() if '{0}_v'.format(name) in x]
         lastest_code_version = module.latest_version(name)
@@ -422,12 +426,14 @@ def get_response(handler, session_name):
                                      title="slave session {0} not available for scenario {1}".format(
                                          session_name, scenario_key))
 
-        session['ext_cache'] = user_cache
+        # the session is shared with other requests of this worker
+        session = dict(session, ext_cache=user_cache)
         result = match(stubo_request, session, trace_matcher,
                        as_date(system_date),
                        url_args=url_args,
                        hooks=handler.settings['hooks'],
-                       module_system_date=module_system_date)
+                       module_system_date=module_system_date,
+                       parallel=handler.settings.get('parallel_matcher'))
         if not result[0]:
             raise exception_response(400,
                                      title='E017:No matching response found')
@@ -474,16 +480,18 @@ def get_response(handler, session_name):
     trace_response.info('found response')
     module_system_date = as_date(module_system_date) if module_system_date \
         else module_system_date
-    stub, _ = transform(stub,
-                        stubo_request,
-                        module_system_date=module_system_date,
-                        system_date=as_date(system_date),
-                        function='get/response',
-                        cache=user_cache,
-                        hooks=handler.settings['hooks'],
-                        stage='response',
-                        trace=trace_response,
-                        url_args=url_args)
+    hooks = handler.settings['hooks']
+    if hooks.transforms_static_stubs() or stub.needs_transform('response'):
+        stub, _ = transform(stub,
+                            stubo_request,
+                            module_system_date=module_system_date,
+                            system_date=as_date(system_date),
+                            function='get/response',
+                            cache=user_cache,
+                            hooks=hooks,
+                            stage='response',
+                            trace=trace_response,
+                            url_args=url_args)
     transfomed_response_text = stub.response_body()[0]
     # Note transformed_response_text can be encoded in utf8
     if response_text[0] != transfomed_response_text:
@@ -498,6 +506,100 @@ def get_response(handler, session_name):
     return transfomed_response_text
 
 
+class ResponseEnvelope(object):
+    """Stands in for the request handler of one request of a get/responses
+    batch. The envelope holds the request body and the Stubo-Request-*
+    headers of a single get/response request, the other arguments and
+    settings are those of the batch.
+    """
+
+    def __init__(self, handler, envelope):
+        if not isinstance(envelope, dict):
+            raise exception_response(400,
+                                     title='request envelope is not a JSON object')
+        headers = {}
+        for k, v in envelope.iteritems():
+            if k.startswith('Stubo-Request-'):
+                # the request headers are matched as a python literal
+                headers[k] = repr(v) if isinstance(v, dict) else v
+        self.handler = handler
+        self.request = DummyModel(headers=headers,
+                                  body=envelope.get('body') or u'',
+                                  host=handler.request.host)
+        self.settings = handler.settings
+        # each request has its own copy as transform updates the url args
+        self.track = ObjectDict(request_params=dict(
+                                    handler.track.request_params),
+                                request_headers=headers,
+                                tracking_level=handler.track.tracking_level)
+        self.status = 200
+        self.headers = {}
+
+    def get_argument(self, name, default=None):
+        return self.handler.get_argument(name, default)
+
+    def set_status(self, status):
+        self.status = status
+
+    def set_header(self, name, value):
+        self.headers[name] = value
+
+
+def get_responses(handler, session_name, envelopes):
+    """Return the responses to a batch of get/response requests. The
+    requests are matched in order, so stateful stubs see them in the same
+    order as separate get/response calls would. An error for one request is
+    returned as its response and does not stop the batch.
+
+    Delays are returned with each response rather than applied. The batch
+    is tracked as a single document with an item for each request.
+    """
+    if not isinstance(envelopes, list):
+        raise exception_response(400,
+                                 title='get/responses expects a JSON array of '
+                                       'request envelopes')
+    responses = []
+    tracks = []
+    for envelope in envelopes:
+        item = None
+        try:
+            item = ResponseEnvelope(handler, envelope)
+            session = item.request.headers.get('Stubo-Request-Session',
+                                               session_name)
+            if not session:
+                raise exception_response(400,
+                                         title='session not supplied in '
+                                               'request envelope.')
+            item.track.session = session
+            body = get_response(item, session)
+            response = dict(status=item.status, body=body)
+            if item.headers:
+                response['headers'] = item.headers
+            delay = item.track.get('delay')
+            if delay:
+                response['delay'] = delay
+        except StuboException, e:
+            response = dict(status=e.code, error=dict(code=e.code,
+                                                      message=e.title))
+        except Exception, e:
+            log.exception('get/responses: unexpected error')
+            response = dict(status=500, error=dict(
+                code=500, message=u'{0}: {1}'.format(e.__class__.__name__,
+                                                     exception_text(e))))
+        responses.append(response)
+        if item:
+            item.track.return_code = response['status']
+            if 'error' in response:
+                item.track.request_text = item.request.body
+                item.track.error = response['error']['message']
+            item.track.pop('request_params')
+            tracks.append(item.track)
+    handler.track.responses = tracks
+    handler.track.number_of_requests = len(envelopes)
+    handler.track.number_of_errors = len([x for x in responses if 'error' in x])
+    return dict(version=version, data=responses)
+
+
 def delete_stubs(handler, scenario_name=None, host=None, force=False):
     """delete all data relating to one named scenario or host/s."""
     log.debug('delete_stubs')
@@ -552,7 +654,7 @@ def delete_stubs(handler, scenario_name=None, host=None, force=False):
 
 
 def begin_session(handler, scenario_name, session_name, mode, system_date=None,
-                  warm_cache=False):
+                  warm_cache=False, adaptive_order=False):
     log.debug('begin_session')
     response = {
         'version': version
@@ -605,7 +707,10 @@ def begin_session(handler, scenario_name, session_name, mode, system_date=None,
             raise exception_response(400, title='Scenario recordings taking '
                                                 'place - {0}. Found the following '
                                                 'record sessions: {1}'.format(scenario_name_key, recordings))
-        cache.create_session_cache(scenario_name, session_name, system_date)
+        start = time.time()
+        session = cache.create_session_cache(scenario_name, session_name,
+                                             system_date, adaptive_order)
+        load_time_ms = int(1000 * (time.time() - start))
         if warm_cache:
             # iterate over stubs and call get/response for each stub matchers
             # to build the request & request_index cache
@@ -625,7 +730,9 @@ def begin_session(handler, scenario_name, session_name, mode, system_date=None,
         response["data"].update({
             "status": "playback",
             "scenario": scenario_name_key,
-            "session": str(session_name)
+            "session": str(session_name),
+            "stubs": len(session['stubs']),
+            "load_time_ms": load_time_ms
         })
     else:
         raise exception_response(400,
@@ -699,7 +806,7 @@ def end_session(handler, session_name):
     session['status'] = 'dormant'
     # clear stubs cache & scenario session data
     session.pop('stubs', None)
-    cache.set(scenario_key, session_name, session)
+    cache.set_session(scenario_name, session_name, session)
     cache.delete_session_data(scenario_name, session_name)
     if session_status == 'record':
         log.debug('store source recording to pre_scenario_stub')
@@ -848,6 +955,9 @@ def get_status(handler):
     try:
         result = redis_server.ping()
         response['data']['cache_server']['status'] = 'ok' if result else 'bad'
+        # connections of this worker process
+        response['data']['cache_server']['pool'] = redis_pool_stats(
+            redis_server)
     except Exception, e:
         response['data']['cache_server']['status'] = 'bad'
         response['data']['cache_server']['error'] = str(e)
@@ -863,10 +973,29 @@ def get_status(handler):
             session = cache.get_session(scenario_key.partition(':')[-1],
                                         session_name)
         response['data']['session'] = session
+        if session.get('adaptive_order') and session.get('stubs'):
+            # stub ordering in this worker process, a plan is not compiled
+            # just to report it
+            key = session_plan_key(session)
+            plan = session_plans.get(key) if key else None
+            if plan is not None and plan.hit_order is not None:
+                response['data']['adaptive_order'] = plan.hit_order.stats()
+            else:
+                response['data']['adaptive_order'] = {
+                    'status': 'no stats in this worker yet'}
     elif scenario_name:
         sessions = list(cache.get_sessions_status(scenario_name,
                                                   local=local_cache))
         response['data']['sessions'] = sessions
+        response['data']['response_compression'] = \
+            cache.get_response_compression(scenario_name)
+
+    # per worker process match caches
+    response['data']['match_cache'] = {
+        'session_plans': session_plans.stats(),
+        'unmatched_requests': unmatched_requests.stats(),
+        'sessions': session_cache.stats()
+    }
 
     check_database = asbool(args.get('check_database', True))
     if check_database:
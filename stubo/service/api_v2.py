@@ -15,12 +15,13 @@ from stubo.utils import get_hostname
 from stubo.cache import Cache
 from stubo.exceptions import exception_response
 import logging
+import time
 
 log = logging.getLogger(__name__)
 
 
 def begin_session(handler, scenario_name, session_name, mode, system_date=None,
-                  warm_cache=False):
+                  warm_cache=False, adaptive_order=False):
     """
     Begins session for given scenario
     :param handler: request handler class
@@ -29,6 +30,7 @@ def begin_session(handler, scenario_name, session_name, mode, system_date=None,
     :param mode: mode - record, playback
     :param system_date:
     :param warm_cache:
+    :param adaptive_order: try the most matched stubs first during playback
     :return: :raise exception_response:
     """
     log.debug('begin_session')
@@ -95,7 +97,10 @@ def begin_session(handler, scenario_name, session_name, mode, system_date=None,
             raise exception_response(400, title='Scenario recordings taking '
                                                 'place - {0}. Found the '
                                                 'following record sessions: {1}'.format(scenario_name_key, recordings))
-        cache.create_session_cache(scenario_name, session_name, system_date)
+        start = time.time()
+        session = cache.create_session_cache(scenario_name, session_name,
+                                             system_date, adaptive_order)
+        load_time_ms = int(1000 * (time.time() - start))
         if warm_cache:
             # iterate over stubs and call get/response for each stub matchers
             # to build the request & request_index cache
@@ -115,7 +120,9 @@ def begin_session(handler, scenario_name, session_name, mode, system_date=None,
         response["data"].update({
             "status": "playback",
             "scenario": scenario_name_key,
-            "session": str(session_name)
+            "session": str(session_name),
+            "stubs": len(session['stubs']),
+            "load_time_ms": load_time_ms
         })
     else:
         raise exception_response(400,
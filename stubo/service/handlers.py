@@ -20,7 +20,8 @@ from stubo.service.handlers_mt import (
     export_stubs_request, list_stubs_request,
     command_handler_request, command_handler_form_request, delay_policy_request,
     stub_count_request, begin_session_request, end_session_request,
-    put_stub_request, get_response_request, delete_stubs_request,
+    put_stub_request, get_response_request, get_responses_request,
+    delete_stubs_request,
     status_request, manage_request, tracker_request,
     tracker_detail_request, get_delay_policy_request,
     delete_delay_policy_request, put_module_request,
@@ -83,6 +84,11 @@ class GetResponseHandler(TrackRequest):
         self.finish()
 
 
+class GetResponsesHandler(TrackRequest):
+    def post(self):
+        get_responses_request(self)
+
+
 class DeleteStubsHandler(TrackRequest):
     def compute_etag(self):
         return None
@@ -974,6 +980,7 @@ class ScenarioActionHandler(TrackRequest):
         }
         """
         warm_cache = asbool(self.get_argument('warm_cache', False))
+        adaptive_order = asbool(self.get_argument('adaptive_order', False))
         if not self.mode:
             raise exception_response(400,
                                      title="'mode' of playback or record required")
@@ -983,7 +990,7 @@ class ScenarioActionHandler(TrackRequest):
                                         self.session_name,
                                         self.mode,
                                         self.get_argument('system_date', None),
-                                        warm_cache)
+                                        warm_cache, adaptive_order)
         # adding scenarioRef key for easier resource access.
         response['data']['scenarioRef'] = '/stubo/api/v2/scenarios/objects/%s' % response['data']['scenario']
         self.write(response)
@@ -3,6 +3,7 @@
     :license: GPLv3, see LICENSE for more details.
 """
 import datetime
+import json
 import logging
 from functools import partial, wraps
 from urlparse import urlparse, parse_qs, unquote
@@ -14,7 +15,7 @@ from tornado.util import ObjectDict
 from .api import (
     export_stubs, list_stubs, run_command_file, run_commands,
     update_delay_policy, stub_count, begin_session, put_stub,
-    get_response, delete_stubs, get_status, get_delay_policy, put_module,
+    get_response, get_responses, delete_stubs, get_status, get_delay_policy, put_module,
     delete_module, list_module, delete_delay_policy, manage_request_api, put_setting, get_setting, end_sessions,
     list_scenarios
 )
@@ -313,17 +314,31 @@ def get_response_request(handler):
     return get_response(handler, session_name)
 
 
+@stubo_async
+def get_responses_request(handler):
+    try:
+        envelopes = json.loads(handler.request.body)
+    except ValueError:
+        raise exception_response(400,
+                                 title='get/responses expects a JSON array of '
+                                       'request envelopes')
+    return get_responses(handler, handler.get_argument('session', None),
+                         envelopes)
+
+
 @stubo_async
 def begin_session_request(handler):
     scenario = handler.track.scenario = get_scenario_arg(handler)
     session = get_session_arg(handler)
     mode = handler.get_argument('mode', None)
     warm_cache = asbool(handler.get_argument('warm_cache', False))
+    adaptive_order = asbool(handler.get_argument('adaptive_order', False))
     if not mode:
         raise exception_response(400,
                                  title="'mode' of playback or record required")
     return begin_session(handler, scenario, session, mode,
-                         handler.get_argument('system_date', None), warm_cache)
+                         handler.get_argument('system_date', None), warm_cache,
+                         adaptive_order)
 
 
 @stubo_async
@@ -8,12 +8,15 @@ import time
 import sys
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import socket
+import multiprocessing
 
 import tornado.web, tornado.ioloop, tornado.httpserver
 from tornado.util import ObjectDict
 from statsd import StatsClient
 
 from stubo.service.handlers import HandlerFactory
+from stubo.match.parallel import ParallelMatcher
+from stubo.cache import session_cache
 from stubo.utils import (
     read_config, init_mongo, start_redis, asbool, init_ext_cache, resolve_class
 )
@@ -125,6 +128,23 @@ class TornadoManager(object):
         tornado_app.settings['process_executor'] = ProcessPoolExecutor(max_process_workers)
         log.info('started with {0} worker processes'.format(tornado_app.settings['process_executor']._max_workers))
 
+        parallel_match_threshold = int(self.cfg.get('parallel_match_threshold',
+                                                    0))
+        if parallel_match_threshold:
+            workers = int(self.cfg.get('parallel_match_workers',
+                                       multiprocessing.cpu_count()))
+            chunk_size = int(self.cfg.get('parallel_match_chunk_size', 0))
+            tornado_app.settings['parallel_matcher'] = ParallelMatcher(
+                ProcessPoolExecutor(workers), workers,
+                parallel_match_threshold, chunk_size)
+            log.info('matching sessions with {0} or more candidate stubs on '
+                     '{1} processes'.format(parallel_match_threshold, workers))
+
+        # each worker process keeps its own decoded sessions
+        session_cache.maxsize = int(self.cfg.get('session_cache_size', 100))
+        session_cache_mb = int(self.cfg.get('session_cache_mb', 0))
+        session_cache.maxbytes = session_cache_mb * 1024 * 1024 or None
+
         cmd_queue = InternalCommandQueue()
         cmd_queue_poll_interval = self.cfg.get('cmd_queue_poll_interval',
                                                60 * 1000)
@@ -2,7 +2,8 @@ import mock
 import unittest
 
 from stubo.testing import (
-    DummyCache, DummyScenario, DummyRequestHandler, DummyTracker, make_stub
+    DummyCache, DummyScenario, DummyRequestHandler, DummyTracker, make_stub,
+    make_cache_stub
 )
 
 
@@ -184,11 +185,13 @@ class TestSession(unittest.TestCase):
         self.scenario.insert_stub(doc, stateful=True)
         response = begin_session(self.make_request(), 'foo', '1', 'playback',
                                  system_date=None, warm_cache=False)
+        self.assertTrue(response['data'].pop('load_time_ms') >= 0)
         self.assertEqual(response['data'], {
             'status': 'playback',
             'message': 'Playback mode initiated....',
             'session': '1',
-            'scenario': 'localhost:foo'
+            'scenario': 'localhost:foo',
+            'stubs': 1
         })
 
     def test_play_no_scenario(self):
@@ -1343,12 +1346,53 @@ class TestDelayPolicy(unittest.TestCase):
 
 
 class TestGetStatus(unittest.TestCase):
+
+    def setUp(self):
+        from stubo.match.plan import session_plans
+        session_plans.clear()
+
+    def tearDown(self):
+        from stubo.match.plan import session_plans
+        session_plans.clear()
+
     def test_call(self):
         from stubo.service.api import get_status
 
         response = get_status(DummyRequestHandler())
         self.assertEqual(response.keys(), ['version', 'data'])
 
+    def _adaptive_order_status(self):
+        from stubo.service.api import get_status
+        session = {
+            "session": "bar",
+            "scenario": "localhost:foo",
+            "version": "1",
+            "adaptive_order": True,
+            "stubs": [make_cache_stub(["get my stub"], [1])]
+        }
+        cache = mock.Mock()
+        cache.get_scenario_key.return_value = 'localhost:foo'
+        cache.get_session.return_value = session
+        with mock.patch('stubo.service.api.get_redis_server'), \
+                mock.patch('stubo.service.api.redis_pool_stats'), \
+                mock.patch('stubo.service.api.Cache', return_value=cache):
+            response = get_status(DummyRequestHandler(
+                session=['bar'], check_database=['false']))
+        return session, response['data']['adaptive_order']
+
+    def test_adaptive_order_no_plan(self):
+        from stubo.match.plan import session_plans
+        _, stats = self._adaptive_order_status()
+        self.assertEqual(stats, {'status': 'no stats in this worker yet'})
+        self.assertEqual(len(session_plans), 0)
+
+    def test_adaptive_order(self):
+        from stubo.match.plan import compile_session
+        session, _ = self._adaptive_order_status()
+        compile_session(session)
+        _, stats = self._adaptive_order_status()
+        self.assertTrue('reorders' in stats)
+
 
 from stubo.model.cmds import TextCommandsImporter
 
@@ -1356,3 +1400,93 @@ from stubo.model.cmds import TextCommandsImporter
 class DummyStuboCommandFile(TextCommandsImporter):
     def run_command(self, url, priority):
         return 200
+
+
+class TestGetResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch('stubo.service.api.get_response',
+                                self._get_response)
+        self.patch.start()
+        self.calls = []
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def _get_response(self, handler, session_name):
+        from stubo.exceptions import exception_response
+        self.calls.append((session_name, handler.request.body))
+        if handler.request.body == 'nothing':
+            raise exception_response(400,
+                                     title='E017:No matching response found')
+        handler.set_header('Content-Type', 'text/plain')
+        handler.track.delay = 10
+        return 'response to {0}'.format(handler.request.body)
+
+    def _func(self, session_name, envelopes):
+        from stubo.service.api import get_responses
+        handler = DummyRequestHandler()
+        return handler, get_responses(handler, session_name, envelopes)
+
+    def test_responses_in_order(self):
+        handler, response = self._func('first_1', [
+            {'body': 'one'}, {'body': 'nothing'},
+            {'body': 'two', 'Stubo-Request-Session': 'first_2'}])
+        self.assertEqual(self.calls, [('first_1', 'one'),
+                                      ('first_1', 'nothing'),
+                                      ('first_2', 'two')])
+        data = response['data']
+        self.assertEqual(data[0], dict(status=200, body='response to one',
+                                       headers={'Content-Type': 'text/plain'},
+                                       delay=10))
+        self.assertEqual(data[1], dict(status=400, error=dict(
+            code=400, message='E017:No matching response found')))
+        self.assertEqual(data[2]['body'], 'response to two')
+        self.assertEqual(handler.track.number_of_errors, 1)
+        self.assertEqual([x.return_code for x in handler.track.responses],
+                         [200, 400, 200])
+        self.assertEqual(handler.track.responses[1].request_text, 'nothing')
+
+    def test_request_headers(self):
+        from stubo.model.request import StuboRequest
+        envelopes = [{'body': 'one', 'Stubo-Request-Method': 'GET',
+                      'Stubo-Request-Headers': {'Accept': 'text/xml'}}]
+        with mock.patch('stubo.service.api.get_response') as get_response:
+            get_response.return_value = ''
+            self._func('first_1', envelopes)
+        request = StuboRequest(get_response.call_args[0][0].request)
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.request_headers(), {'Accept': 'text/xml'})
+
+    def test_request_params_not_shared(self):
+        params = []
+
+        def get_response(handler, session_name):
+            params.append(dict(handler.track.request_params))
+            handler.track.request_params[handler.request.body] = '1'
+            return ''
+
+        with mock.patch('stubo.service.api.get_response', get_response):
+            handler, response = self._func('first_1', [{'body': 'one'},
+                                                       {'body': 'two'}])
+        self.assertFalse('one' in params[1])
+        self.assertFalse('one' in handler.track.request_params)
+
+    def test_unicode_error(self):
+        def get_response(handler, session_name):
+            raise ValueError(u'caf\xe9')
+
+        with mock.patch('stubo.service.api.get_response', get_response):
+            handler, response = self._func('first_1', [{'body': 'one'}])
+        self.assertEqual(response['data'][0]['error']['message'],
+                         u'ValueError: caf\xe9')
+
+    def test_missing_session(self):
+        handler, response = self._func(None, [{'body': 'one'}])
+        self.assertEqual(response['data'][0]['status'], 400)
+        self.assertEqual(self.calls, [])
+
+    def test_not_a_list(self):
+        from stubo.exceptions import HTTPClientError
+        with self.assertRaises(HTTPClientError):
+            self._func('first_1', {'body': 'one'})
@@ -14,6 +14,7 @@ json_api = [
     # stubs
     ("/stubo/api/get/response", "GetResponseHandler"),
     ("/stubo/api/get/response/.*", "GetResponseHandler"),
+    ("/stubo/api/get/responses", "GetResponsesHandler"),
     ("/stubo/api/put/stub", "PutStubHandler"),
     # scenarios
     ("/stubo/api/delete/stubs", "DeleteStubsHandler"),
@@ -3,6 +3,8 @@
     :license: GPLv3, see LICENSE for more details.
 """
 import os
+import re
+import fnmatch
 from tempfile import mkdtemp
 from tornado.util import ObjectDict
 from tornado.testing import AsyncHTTPTestCase
@@ -179,9 +181,19 @@ class DummyHash(object):
     def keys(self, name):
         return self._keys.get(name, {}).keys()
 
+    def scan(self, name, match=None, count=None):
+        keys = self.keys(name)
+        if match:
+            pattern = re.sub(r'\\(.)', r'[\1]', match)
+            keys = [x for x in keys if fnmatch.fnmatchcase(x, pattern)]
+        return iter(keys)
+
     def remove(self, name):
         return self._keys.pop(name, None)
 
+    def unlink(self, *names):
+        return len([x for x in names if self._keys.pop(x, None) is not None])
+
     def exists(self, key, name):
         item = self._keys.get(key)
         if not item:
@@ -243,6 +255,14 @@ class DummyHash(object):
 
         self.set_raw(name, key, json.dumps(value))
 
+    def set_many(self, name, mapping):
+        for key, value in mapping.iteritems():
+            self.set(name, key, value)
+
+    def set_many_raw(self, name, mapping):
+        for key, value in mapping.iteritems():
+            self.set_raw(name, key, value)
+
     def incr(self, name, key, amount=1):
         val = self.get(name, key)
         if val:
@@ -250,6 +250,38 @@ class TestDelays(Base):
         self.assertEqual(payload['data'], {})
 
 
+class TestGetResponses(Base):
+    def test_get_responses(self):
+        self.http_client.fetch(self.get_url('/stubo/api/put/delay_policy?'
+                                            'name=delay_1&delay_type=fixed&milliseconds=1000'), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 200)
+        self.http_client.fetch(self.get_url('/stubo/api/exec/cmds?cmdfile='
+                                            '/static/cmds/demo/first_setup.commands'), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 200)
+
+        envelopes = [{'body': 'get my stub'}, {'body': 'nothing'}]
+        self.http_client.fetch(self.get_url(
+            '/stubo/api/get/responses?session=first_1'),
+            callback=self.stop, method="POST", body=json.dumps(envelopes))
+        response = self.wait()
+        self.assertEqual(response.code, 200)
+        # delays are returned rather than applied
+        self.assertTrue(float(response.request_time) < 0.999)
+        payload = json.loads(response.body)['data']
+        self.assertEqual(payload[0]['status'], 200)
+        self.assertEqual(payload[0]['body'], 'Hello 2 World\n')
+        self.assertEqual(payload[0]['delay'], 1000)
+        self.assertEqual(payload[1]['error']['message'],
+                         'E017:No matching response found')
+
+        tracks = list(self.db.tracker.find({'function': 'get/responses'}))
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual([x['return_code'] for x in tracks[0]['responses']],
+                         [200, 400])
+
+
 class TestMatching(Base):
     def test_no_match_found(self):
         self.http_client.fetch(self.get_url('/stubo/api/exec/cmds?cmdfile='
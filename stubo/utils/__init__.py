@@ -21,6 +21,8 @@ from asyncore import compact_traceback
 from StringIO import StringIO
 from importlib import import_module
 import hashlib
+import ast
+import re
 
 from pytz import timezone
 import redis
@@ -35,6 +37,7 @@ from pygments.formatters import HtmlFormatter
 from dogpile.cache import make_region
 
 from stubo.scripts import get_default_config
+from stubo.utils.lru import LRUCache
 
 log = logging.getLogger(__name__)
 
@@ -81,34 +84,113 @@ def read_config(config_file_path=None, section=None):
     return dict(config.items(section))
 
 
-def setup_redis(host='localhost', port=6379, db=0, password=None):
-    return redis.Redis(host, port, db, password)
+def setup_redis(host='localhost', port=6379, db=0, password=None,
+                unix_socket_path=None, max_connections=None, pool_timeout=20,
+                socket_timeout=None, socket_connect_timeout=None,
+                socket_keepalive=False, hiredis=None):
+    """Return a redis client with its own connection pool.
+
+    With ``max_connections`` threads wait up to ``pool_timeout`` seconds for
+    a free connection rather than opening more. ``hiredis`` selects the
+    hiredis (True) or python (False) reply parser, by default hiredis is
+    used if it is installed.
+    """
+    kwargs = dict(db=db, password=password, socket_timeout=socket_timeout)
+    if hiredis is not None:
+        if hiredis and not redis.connection.HIREDIS_AVAILABLE:
+            log.warn('hiredis is not installed, using the python redis parser')
+        elif hiredis:
+            kwargs['parser_class'] = redis.connection.HiredisParser
+        else:
+            kwargs['parser_class'] = redis.connection.PythonParser
+    if unix_socket_path:
+        kwargs.update(path=unix_socket_path,
+                      connection_class=redis.UnixDomainSocketConnection)
+    else:
+        kwargs.update(host=host, port=port,
+                      socket_connect_timeout=socket_connect_timeout,
+                      socket_keepalive=socket_keepalive)
+    if max_connections:
+        pool = redis.BlockingConnectionPool(max_connections=max_connections,
+                                            timeout=pool_timeout, **kwargs)
+    else:
+        pool = redis.ConnectionPool(**kwargs)
+    return redis.Redis(connection_pool=pool)
+
+def redis_settings(settings, prefix):
+    """Return the setup_redis arguments from the settings for 'redis' or
+    'redis_master'."""
+    def get(name, default=None, convert=None):
+        value = settings.get('{0}.{1}'.format(prefix, name))
+        if value is None or value == '':
+            return default
+        return convert(value) if convert else value
+
+    return dict(host=get('host', '127.0.0.1'),
+                port=get('port', 6379, int),
+                db=get('db', 0, int),
+                password=get('password'),
+                unix_socket_path=get('unix_socket_path'),
+                max_connections=get('max_connections', None, int),
+                pool_timeout=get('pool_timeout', 20, float),
+                socket_timeout=get('socket_timeout', None, float),
+                socket_connect_timeout=get('socket_connect_timeout', None,
+                                           float),
+                socket_keepalive=get('socket_keepalive', False, asbool),
+                hiredis=get('hiredis', None, asbool))
+
+def redis_pool_stats(server):
+    """Return the connection pool utilisation of a redis client."""
+    pool = server.connection_pool
+    if isinstance(pool, redis.BlockingConnectionPool):
+        created = len(pool._connections)
+        available = len([x for x in pool.pool.queue if x is not None])
+        in_use = created - available
+    else:
+        created = pool._created_connections
+        available = len(pool._available_connections)
+        in_use = len(pool._in_use_connections)
+    parser = pool.connection_kwargs.get('parser_class',
+                                        redis.connection.DefaultParser)
+    return dict(max_connections=pool.max_connections,
+                created=created,
+                in_use=in_use,
+                available=available,
+                connection=pool.connection_class.__name__,
+                parser=parser.__name__)
 
 def init_redis(settings):
-    host = settings.get('redis.host', '127.0.0.1')
-    port = int(settings.get('redis.port', 6379))
-    db = int(settings.get('redis.db', 0))
-    passwd = settings.get('redis.password')            
     import stubo.cache.queue
-    stubo.cache.queue.redis_server = setup_redis(host, port, db, passwd)
+    stubo.cache.queue.redis_server = setup_redis(**redis_settings(settings,
+                                                                  'redis'))
     return stubo.cache.queue.redis_server
 
 def init_redis_master(settings):
-    host = settings.get('redis_master.host', '127.0.0.1')
-    port =  int(settings.get('redis_master.port', 6379))
-    db =  int(settings.get('redis_master.db', 0))
-    passwd = settings.get('redis_master.password')            
     import stubo.cache.queue
-    stubo.cache.queue.redis_master_server = setup_redis(host, port, db, passwd)
+    stubo.cache.queue.redis_master_server = setup_redis(**redis_settings(
+        settings, 'redis_master'))
     return stubo.cache.queue.redis_master_server
 
 def start_redis(cfg):
-    redis_local = (cfg.get('redis.host', '127.0.0.1'),
-                   int(cfg.get('redis.port', 6379)),
-                   int(cfg.get('redis.db', 0)))
-    redis_master = (cfg.get('redis_master.host', '127.0.0.1'),
-                    int(cfg.get('redis_master.port', 6379)),
-                    int(cfg.get('redis_master.db', 0)))  
+    def address(prefix):
+        settings = redis_settings(cfg, prefix)
+        return tuple(settings[x] for x in ('host', 'port', 'db',
+                                           'unix_socket_path'))
+
+    import stubo.cache
+    stubo.cache.queue.scan_count = int(cfg.get('redis.scan_count', 1000))
+    layout = cfg.get('session_key_layout', 'scenario')
+    if layout not in stubo.cache.SESSION_KEY_LAYOUTS:
+        raise ValueError('session_key_layout must be one of {0}, not '
+                         '{1}'.format(stubo.cache.SESSION_KEY_LAYOUTS, layout))
+    stubo.cache.session_key_layout = layout
+    stubo.cache.codec.set_codec(cfg.get('redis.codec', 'json'))
+    stubo.cache.codec.compress_threshold = int(cfg.get(
+        'response_compress_threshold', 0))
+    stubo.cache.codec.compress_level = int(cfg.get('response_compress_level',
+                                                   6))
+    redis_local = address('redis')
+    redis_master = address('redis_master')
     retry_count = int(cfg.get('retry_count', 10)) 
     retry_interval = int(cfg.get('retry_interval', 10))
     redis_local_server = init_redis(cfg)
@@ -124,7 +206,6 @@ def start_redis(cfg):
                          'secs'.format(retry_interval))
                 time.sleep(retry_interval)    
     else:
-        import stubo.cache.queue
         redis_master_server = redis_local_server
         stubo.cache.queue.redis_master_server = redis_master_server
     return redis_local_server, redis_master_server
@@ -288,6 +369,76 @@ def compact_traceback_info(tb):
     # file, function, line = tbinfo[-1]
     return ' '.join(['[%s|%s|%s]' % x for x in tbinfo])
 
+def strip_whitespace(text):
+    """Return text with all whitespace removed, the form in which the
+    contains matcher compares request bodies."""
+    return u''.join(text.split())
+
+def normalised_chunks(text, chunk_size=65536):
+    """Yield text with its whitespace removed a chunk at a time, so only a
+    chunk of a large text is copied at once."""
+    for start in xrange(0, len(text), chunk_size):
+        yield strip_whitespace(text[start:start + chunk_size])
+
+# contains matchers are found in text by a regex for their first
+# CONTAINS_PREFIX_SIZE characters with optional whitespace between them, the
+# rest is compared from where the regex matched
+CONTAINS_PREFIX_SIZE = 64
+contains_patterns = LRUCache(maxsize=1000)
+
+def contains_pattern(prefix, flags):
+    key = prefix, flags
+    pattern = contains_patterns.get(key)
+    if pattern is None:
+        pattern = re.compile(u'\\s*'.join(re.escape(x) for x in prefix), flags)
+        contains_patterns.set(key, pattern)
+    return pattern
+
+def continues_with(text, pos, normalised, start):
+    """Return True if text from pos with its whitespace removed starts with
+    normalised[start:]. Only as much of text as is left to compare is
+    copied at a time."""
+    while start < len(normalised):
+        raw = text[pos:pos + len(normalised) - start]
+        if not raw:
+            return False
+        chunk = strip_whitespace(raw)
+        if not normalised.startswith(chunk, start):
+            return False
+        start += len(chunk)
+        pos += len(raw)
+    return True
+
+def contains_normalised(text, normalised):
+    """Return True if the whitespace free normalised text is found in text
+    with its whitespace removed, without a whitespace free copy of text."""
+    if not normalised:
+        return True
+    # whitespace as split by unicode or str
+    flags = re.UNICODE if isinstance(text, unicode) else 0
+    pattern = contains_pattern(normalised[:CONTAINS_PREFIX_SIZE], flags)
+    match = pattern.search(text)
+    while match:
+        if continues_with(text, match.end(), normalised,
+                          CONTAINS_PREFIX_SIZE):
+            return True
+        # the prefix may occur again overlapping this match
+        match = pattern.search(text, match.start() + 1)
+    return False
+
+def exception_text(e):
+    """Return the message of the exception as unicode, whether it was raised
+    with a unicode or an encoded message."""
+    try:
+        return unicode(e)
+    except UnicodeError:
+        return str(e).decode('utf-8', 'replace')
+
+def literal_dict(text):
+    """Return a dict from the python literal of a dict or of a sequence of
+    pairs, without evaluating any code."""
+    return dict(ast.literal_eval(text))
+
 def compute_hash(data):
     if isinstance(data, unicode):
         _hash = hashlib.sha224(data.encode('utf-8')).hexdigest()
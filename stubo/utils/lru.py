@@ -0,0 +1,88 @@
+"""
+    stubo.utils.lru
+    ~~~~~~~~~~~~~~~
+
+    A small thread safe LRU cache used for per worker caching.
+
+    :copyright: (c) 2015 by OpenCredo.
+    :license: GPLv3, see LICENSE for more details.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used item once
+    ``maxsize`` items are held, or once the items given a size in bytes add
+    up to more than ``maxbytes``. Hits and misses are counted so the
+    effectiveness of the cache can be reported.
+    """
+
+    def __init__(self, maxsize=100, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, valid=None):
+        """Return the value for key. A value for which the optional ``valid``
+        function returns False is dropped and counted as a miss."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if valid is not None and not valid(value):
+                self.nbytes -= self._sizes.pop(key, 0)
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value, nbytes=0):
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+            if nbytes:
+                self._sizes[key] = nbytes
+                self.nbytes += nbytes
+            while len(self._data) > self.maxsize or (
+                    self.maxbytes and self.nbytes > self.maxbytes and
+                    len(self._data) > 1):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key, default=None):
+        self.nbytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key, default)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._remove(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(size=len(self._data),
+                    maxsize=self.maxsize,
+                    nbytes=self.nbytes,
+                    maxbytes=self.maxbytes,
+                    hits=self.hits,
+                    misses=self.misses,
+                    hit_ratio=round(float(self.hits) / lookups, 3) if lookups else 0)
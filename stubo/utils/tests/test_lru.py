@@ -0,0 +1,58 @@
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def _make(self, maxsize=2):
+        from stubo.utils.lru import LRUCache
+        return LRUCache(maxsize)
+
+    def test_get_set(self):
+        cache = self._make()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hit_ratio'], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = self._make()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_pop(self):
+        cache = self._make()
+        cache.set('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a'), None)
+
+    def test_evicts_over_maxbytes(self):
+        from stubo.utils.lru import LRUCache
+        cache = LRUCache(10, maxbytes=100)
+        cache.set('a', 1, nbytes=40)
+        cache.set('b', 2, nbytes=40)
+        cache.set('a', 1, nbytes=50)
+        self.assertEqual(cache.nbytes, 90)
+        cache.set('c', 3, nbytes=30)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.nbytes, 80)
+        cache.pop('a')
+        self.assertEqual(cache.stats()['nbytes'], 30)
+        # the most recent item is kept whatever its size
+        cache.set('d', 4, nbytes=200)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, 200)
+
+    def test_invalid_value_dropped(self):
+        cache = self._make()
+        cache.set('a', 1, nbytes=10)
+        self.assertEqual(cache.get('a', valid=lambda x: x == 2), None)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.nbytes, 0)
+        self.assertEqual(cache.misses, 1)
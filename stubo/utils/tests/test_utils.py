@@ -0,0 +1,50 @@
+import unittest
+
+
+class TestSetupRedis(unittest.TestCase):
+
+    def test_default_settings(self):
+        from stubo.utils import redis_settings
+        settings = redis_settings({'redis.host': 'cache', 'redis.port': '6380'},
+                                  'redis')
+        self.assertEqual(settings['host'], 'cache')
+        self.assertEqual(settings['port'], 6380)
+        self.assertEqual(settings['max_connections'], None)
+        self.assertEqual(settings['hiredis'], None)
+        self.assertEqual(redis_settings({}, 'redis_master')['host'],
+                         '127.0.0.1')
+
+    def test_pool_settings(self):
+        from stubo.utils import redis_settings, setup_redis, redis_pool_stats
+        settings = redis_settings({
+            'redis_master.max_connections': '10',
+            'redis_master.socket_timeout': '2.5',
+            'redis_master.socket_keepalive': 'true',
+            'redis_master.hiredis': 'false'}, 'redis_master')
+        server = setup_redis(**settings)
+        pool = server.connection_pool
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 2.5)
+        self.assertTrue(pool.connection_kwargs['socket_keepalive'])
+        self.assertEqual(redis_pool_stats(server), dict(
+            max_connections=10, created=0, in_use=0, available=0,
+            connection='Connection', parser='PythonParser'))
+
+    def test_unix_socket(self):
+        from stubo.utils import setup_redis, redis_pool_stats
+        server = setup_redis(unix_socket_path='/tmp/redis.sock')
+        self.assertEqual(server.connection_pool.connection_kwargs['path'],
+                         '/tmp/redis.sock')
+        self.assertEqual(redis_pool_stats(server)['connection'],
+                         'UnixDomainSocketConnection')
+
+
+class TestExceptionText(unittest.TestCase):
+
+    def test_unicode(self):
+        from stubo.utils import exception_text
+        self.assertEqual(exception_text(ValueError(u'caf\xe9')), u'caf\xe9')
+
+    def test_encoded(self):
+        from stubo.utils import exception_text
+        self.assertEqual(exception_text(ValueError(u'caf\xe9'.encode('utf-8'))),
+                         u'caf\xe9')